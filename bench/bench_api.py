@@ -0,0 +1,62 @@
+"""
+bench_api.py
+Load test of a running API: CLIENTS threads send GET requests to the same
+route over keep-alive connections for DURATION seconds, then the request
+rate and the latency percentiles are printed. Run it once against the
+development server and once against gunicorn to compare them.
+
+Usage (from the repository root, redis seeded e.g. with bench_filter.py):
+    python src/atx_traffic.py                          # development server
+    gunicorn -c src/gunicorn.conf.py atx_traffic:app   # production server
+    python bench/bench_api.py --url 'http://127.0.0.1:5000/incidents?limit=100' --clients 16
+"""
+import argparse
+import threading
+import time
+import numpy as np
+import requests
+
+
+def client_loop(url:str, stop_at:float, latencies:list, errors:list) -> None:
+    """Sends requests until `stop_at`, recording the latency (ms) of each successful one."""
+    session = requests.Session() # keeps the connection alive between requests
+    while time.perf_counter() < stop_at:
+        start_time = time.perf_counter()
+        try:
+            response = session.get(url)
+            response.content
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        if ok:
+            latencies.append((time.perf_counter() - start_time) * 1000)
+        else:
+            errors.append(1)
+
+
+def run(url:str, clients:int, duration:float, warmup:float) -> None:
+    if warmup:
+        client_loop(url, time.perf_counter() + warmup, [], []) # e.g. the first snapshot load
+    latencies = []
+    errors = []
+    stop_at = time.perf_counter() + duration
+    threads = [threading.Thread(target=client_loop, args=(url, stop_at, latencies, errors)) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f'{url}, {clients} client(s), {duration:.0f} s')
+    print(f'{len(latencies) / duration:.1f} requests/s, {len(errors)} error(s)')
+    if latencies:
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        print(f'latency ms: p50 {p50:.1f}, p95 {p95:.1f}, p99 {p99:.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000/incidents?limit=100')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--warmup', type=float, default=2)
+    args = parser.parse_args()
+    run(args.url, args.clients, args.duration, args.warmup)
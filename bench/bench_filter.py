@@ -0,0 +1,114 @@
+"""
+bench_filter.py
+Compares the per-request cost of GET /incidents style filtering before
+(KEYS + one HGETALL per predicate per key) and after (secondary indexes +
+pipelined fetches, see src/query.py) on a seeded local redis.
+
+Usage (from the repository root, redis running locally):
+    python bench/bench_filter.py --db 9 --incidents 20000
+
+WARNING: the selected database is flushed before seeding.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import geopy.distance
+import redis
+from ingest import write_incidents
+from query import filter_incidents
+from storage import STORAGE_FORMAT
+
+ISSUES = ['Crash Urgent', 'Traffic Hazard', 'Stalled Vehicle', 'COLLISION', 'LOOSE LIVESTOCK']
+STATUSES = ['ACTIVE', 'ARCHIVED']
+QUERIES = {
+    'all': {},
+    'type+status': {'incident_type': 'crash urgent', 'status': 'active'},
+    'time range': {'start': 1600000000, 'end': 1610000000},
+    'radius 3mi': {'radius': 3, 'lng': -97.7431, 'lat': 30.2672},
+}
+
+round_trips = 0
+_send_packed_command = redis.connection.Connection.send_packed_command
+
+def _counting_send_packed_command(self, *args, **kwargs):
+    global round_trips
+    round_trips += 1
+    return _send_packed_command(self, *args, **kwargs)
+
+redis.connection.Connection.send_packed_command = _counting_send_packed_command
+
+
+def seed(client, count:int, storage_format:str=STORAGE_FORMAT) -> None:
+    """Flushes the database and writes `count` synthetic incidents through the ingest path."""
+    random.seed(0)
+    client.flushdb()
+    incidents = []
+    for ii in range(count):
+        published = random.randint(1500000000, 1680000000)
+        lat = 30.0 + random.random() * 1.1
+        lon = -98.9 + random.random() * 1.9
+        incidents.append({'traffic_report_id': f'{ii:040X}_{published}',
+                          'published_date': str(published),
+                          'issue_reported': random.choice(ISSUES),
+                          'location': f'({lat:.6f},{lon:.6f})',
+                          'latitude': f'{lat:.6f}',
+                          'longitude': f'{lon:.6f}',
+                          'address': 'N Lamar Blvd',
+                          'traffic_report_status': random.choice(STATUSES),
+                          'traffic_report_status_date_time': str(published + random.randint(0, 5000))})
+    write_incidents(client, incidents, batch_size=5000, storage_format=storage_format)
+
+
+def legacy_filter(client, incident_type='all', status='all', start=float('-inf'), end=float('inf'),
+                  radius=float('inf'), lng=None, lat=None):
+    """Filtering as done before the indexes: KEYS, then HGETALL once per predicate per key."""
+    is_type = lambda incident: incident_type == 'all' or incident['issue_reported'].lower() == incident_type
+    is_status = lambda incident: status == 'all' or incident['traffic_report_status'].lower() == status
+    in_time = lambda incident: start <= float(incident['published_date']) <= end
+    in_bounds = lambda incident: radius == float('inf') or \
+        geopy.distance.geodesic((lat, lng), (incident['latitude'], incident['longitude'])).miles <= radius
+    keys = [key for key in client.keys() if ':' not in key]
+    return [client.hgetall(key) for key in keys
+            if is_type(client.hgetall(key)) and is_status(client.hgetall(key))
+            and in_time(client.hgetall(key)) and in_bounds(client.hgetall(key))]
+
+
+def indexed_filter(client, **query):
+    """Filtering through the secondary indexes and pipelined fetches (src/query.py)."""
+    return filter_incidents(client, **query)[0]
+
+
+def measure(function, client, query:dict, repeat:int):
+    """Returns (round-trips per request, mean latency in ms, number of results)."""
+    global round_trips
+    round_trips = 0
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        results = function(client, **query)
+    elapsed = (time.perf_counter() - start_time) / repeat
+    return round_trips / repeat, elapsed * 1000, len(results)
+
+
+def run(client, count:int, repeat:int) -> None:
+    seed(client, count)
+    print(f'{count} incidents, mean over {repeat} request(s)')
+    print(f'{"query":<12} {"impl":<7} {"round-trips":>12} {"latency ms":>11} {"results":>8}')
+    for name, query in QUERIES.items():
+        for impl, function in (('before', legacy_filter), ('after', indexed_filter)):
+            trips, latency, results = measure(function, client, query, repeat)
+            print(f'{name:<12} {impl:<7} {trips:>12.0f} {latency:>11.1f} {results:>8}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('REDIS_HOSTNAME', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=9)
+    parser.add_argument('--incidents', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=True),
+        args.incidents, args.repeat)
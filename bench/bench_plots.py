@@ -0,0 +1,78 @@
+"""
+bench_plots.py
+Times the stages of the plot jobs (load, bin, draw + render, store) on a
+seeded local redis, for every image format. Nothing leaves the machine:
+images go to the 'redis' image store of the benchmark database.
+
+Usage (from the repository root, redis running locally):
+    python bench/bench_plots.py --db 9 --incidents 20000
+
+WARNING: the selected database is flushed before seeding.
+"""
+import argparse
+import os
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import redis
+from bench_filter import seed
+from cube import CUBE_READY_KEY
+from dataset import bump_dataset_version
+from image_store import save_image
+from plots import load_plot_data, load_grid_counts, time_histogram, IMAGE_FORMATS
+import worker
+
+
+def timed(function, *args):
+    """Returns (result, elapsed ms) of one call."""
+    start_time = time.perf_counter()
+    result = function(*args)
+    return result, (time.perf_counter() - start_time) * 1000
+
+
+def draw(plot_type:str, data:dict):
+    """Bins the data of a plot type and draws it on the reused figure of the worker."""
+    if plot_type == 'timeseries':
+        return worker.draw_timeseries(*time_histogram(data['published'], 'month'), 'bench')
+    if plot_type == 'dotmap':
+        return worker.draw_dotmap(data['lat'], data['lon'], 'bench')
+    return worker.draw_heatmap(data['counts'], 'bench')
+
+
+def run(client, image_client, count:int, repeat:int) -> None:
+    seed(client, count)
+    client.set(CUBE_READY_KEY, 1) # seeded into an empty database, the cube holds every incident
+    bump_dataset_version(client)
+    _, cold = timed(load_plot_data, client, None, None, False)
+    data = load_plot_data(client) # fills the snapshot cache
+    _, warm = timed(load_plot_data, client)
+    print(f'{count} incidents, load: {cold:.1f} ms from redis, {warm:.1f} ms from the cached snapshot')
+    _, grid = timed(load_grid_counts, client, client, 1550000000, 1650000000)
+    print(f'heatmap counts of a partial date range from the count cube: {grid:.1f} ms')
+    data['counts'] = load_grid_counts(client, client) # what the heatmap jobs draw
+    print(f'mean over {repeat} job(s)')
+    print(f'{"plot":<11} {"format":<15} {"draw ms":>8} {"render ms":>10} {"store ms":>9} {"bytes":>9}')
+    for plot_type in ('timeseries', 'dotmap', 'heatmap'):
+        for image_format in IMAGE_FORMATS:
+            totals = [0.0, 0.0, 0.0]
+            for _ in range(repeat):
+                fig, draw_ms = timed(draw, plot_type, data)
+                image, render_ms = timed(worker.render_image, fig, image_format)
+                results, store_ms = timed(save_image, image_client, image, image_format, 'redis')
+                totals = [totals[0] + draw_ms, totals[1] + render_ms, totals[2] + store_ms]
+            size = len(image.getvalue())
+            print(f'{plot_type:<11} {image_format:<15} {totals[0] / repeat:>8.1f} {totals[1] / repeat:>10.1f} '
+                  f'{totals[2] / repeat:>9.1f} {size:>9}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('REDIS_HOSTNAME', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=9)
+    parser.add_argument('--incidents', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    run(redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=True),
+        redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=False),
+        args.incidents, args.repeat)
@@ -0,0 +1,50 @@
+"""
+bench_storage.py
+Compares the memory used by the incidents in the 'hash' and 'packed' storage
+formats (see src/storage.py) on a seeded local redis, along with the time
+it takes to read the snapshot columns back in each format.
+
+Usage (from the repository root, redis running locally):
+    python bench/bench_storage.py --db 9 --incidents 20000
+
+WARNING: the selected database is flushed before seeding.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import redis
+from bench_filter import seed
+from dataset import incident_keys
+from snapshot import SNAPSHOT_FIELDS
+from storage import iter_incidents, STORAGE_FORMATS
+
+
+def run(client, count:int, sample:int) -> None:
+    print(f'{count} incidents, MEMORY USAGE averaged over {sample} of them')
+    print(f'{"format":<8} {"used_memory MB":>15} {"bytes/incident":>15} {"MEMORY USAGE":>13} {"read ms":>8}')
+    for storage_format in STORAGE_FORMATS:
+        client.flushdb()
+        empty = client.info('memory')['used_memory']
+        seed(client, count, storage_format)
+        used = client.info('memory')['used_memory'] - empty # incidents, dictionaries and indexes
+        keys = random.Random(0).sample(list(incident_keys(client)), min(sample, count))
+        per_key = sum(client.memory_usage(key, samples=0) for key in keys) / len(keys)
+        start_time = time.perf_counter()
+        for _ in iter_incidents(client, incident_keys(client), SNAPSHOT_FIELDS, storage_format=storage_format):
+            pass
+        read_ms = (time.perf_counter() - start_time) * 1000
+        print(f'{storage_format:<8} {used / 2 ** 20:>15.1f} {used / count:>15.0f} {per_key:>13.0f} {read_ms:>8.1f}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default=os.environ.get('REDIS_HOSTNAME', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=6379)
+    parser.add_argument('--db', type=int, default=9)
+    parser.add_argument('--incidents', type=int, default=20000)
+    parser.add_argument('--sample', type=int, default=1000)
+    args = parser.parse_args()
+    run(redis.Redis(host=args.host, port=args.port, db=args.db, decode_responses=True), args.incidents, args.sample)
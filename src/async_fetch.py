@@ -0,0 +1,123 @@
+import asyncio
+import os
+import threading
+import redis.asyncio
+from connections import get_async_pool
+from scan import batched, FETCH_BATCH_SIZE
+from storage import queue_reads, parse_reads, iter_incidents, STORAGE_FORMAT
+from typing import Iterable, Iterator, List, Tuple
+# async_fetch.py
+# Concurrent incident fetches for the heavy read paths of the API (snapshot
+# loads, pages of results). Each process runs one asyncio event loop in a
+# background thread, with a redis.asyncio pool per database (see
+# connections.get_async_pool()): the request threads of the process hand
+# their fetches to that loop, the pipelined batches of a request are sent
+# over several connections at once and every in-flight request shares the
+# same pool of connections.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+ASYNC_FETCH = os.environ.get('ASYNC_FETCH', 'true').lower() in ('1', 'true', 'yes')
+ASYNC_FETCH_CONCURRENCY = int(os.environ.get('ASYNC_FETCH_CONCURRENCY', 4)) # batches in flight per request
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def _event_loop() -> asyncio.AbstractEventLoop:
+    """The event loop of this process, started on first use (and again in a forked child)."""
+    global _loop, _loop_pid
+    with _loop_lock:
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            threading.Thread(target=_loop.run_forever, name='async-fetch', daemon=True).start()
+        return _loop
+
+
+def async_client(client) -> redis.asyncio.Redis:
+    """
+    Description:
+    -----------
+        - Returns a redis.asyncio client of the same database as a synchronous
+            client, backed by the shared pool of the process. Called from the
+            event loop of _event_loop().
+
+    Args:
+    -----------
+        - client: synchronous redis client (see connections.get_client())
+
+    Returns:
+    -----------
+        - redis.asyncio.Redis client
+    """
+    kwargs = client.connection_pool.connection_kwargs
+    return redis.asyncio.Redis(connection_pool=get_async_pool(kwargs.get('db', 0),
+                                                              kwargs.get('decode_responses', False)))
+
+
+async def _read_batch(aclient, keys:List[str], fields:Tuple[str, ...], storage_format:str,
+                      semaphore:asyncio.Semaphore) -> list:
+    """Sends the reads of one batch of incidents in a pipelined round-trip, on its own connection."""
+    async with semaphore:
+        pipe = aclient.pipeline(transaction=False)
+        queue_reads(pipe, keys, fields, storage_format)
+        return await pipe.execute()
+
+
+async def _read_window(client, batches:List[List[str]], fields:Tuple[str, ...], storage_format:str,
+                       concurrency:int) -> List[list]:
+    """
+    Reads several batches of incidents concurrently, at most `concurrency` at a
+    time. Returns the raw replies of every batch: decoding them may reload the
+    dictionaries of the packed format with the synchronous client, which must
+    not block the event loop shared by the request threads.
+    """
+    aclient = async_client(client)
+    semaphore = asyncio.Semaphore(concurrency)
+    return await asyncio.gather(*(_read_batch(aclient, batch, fields, storage_format, semaphore)
+                                  for batch in batches))
+
+
+def iter_incidents_concurrently(client, keys:Iterable, fields:Tuple[str, ...]=None,
+                                batch_size:int=FETCH_BATCH_SIZE, concurrency:int=ASYNC_FETCH_CONCURRENCY,
+                                storage_format:str=STORAGE_FORMAT) -> Iterator[Tuple[str, dict]]:
+    """
+    Description:
+    -----------
+        - Same as storage.iter_incidents(), with `concurrency` pipelined
+            batches in flight at a time instead of one. Keys are consumed a
+            window of batch_size * concurrency keys at a time, so memory does not
+            grow with the number of keys. Falls back to storage.iter_incidents()
+            when ASYNC_FETCH is off.
+
+    Args:
+    -----------
+        - client: synchronous redis client of the incidents database
+        - keys: incident keys
+        - fields, storage_format: see storage.read_incidents()
+        - batch_size: number of keys fetched per round-trip (int)
+        - concurrency: number of round-trips in flight at a time (int)
+
+    Returns:
+    -----------
+        - Iterator of (key, incident) tuples, in the order of `keys`
+    """
+    if not ASYNC_FETCH or concurrency <= 1:
+        yield from iter_incidents(client, keys, fields, batch_size, storage_format)
+        return
+    loop = _event_loop()
+    for window in batched(keys, batch_size * concurrency):
+        batches = list(batched(window, batch_size))
+        if len(batches) == 1:
+            # a single round-trip, nothing to overlap
+            yield from iter_incidents(client, window, fields, batch_size, storage_format)
+            continue
+        future = asyncio.run_coroutine_threadsafe(_read_window(client, batches, fields, storage_format,
+                                                               concurrency), loop)
+        for batch, replies in zip(batches, future.result()):
+            # decoded in the calling thread (see _read_window())
+            yield from zip(batch, parse_reads(client, batch, replies, fields, storage_format))
@@ -1,8 +1,19 @@
-from flask import Flask, request
-from jobs import add_job, get_job_by_id, rd_details, delete_all_jobs
-from typing import List
-import redis
-import requests
+from flask import Flask, request, redirect
+from jobs import add_job, get_job_by_id, rd, rd_staging, rd_locks, rd_details, rd_images, delete_all_jobs
+from image_store import load_image, IMAGE_STORE
+from ingest import load_incidents, INGEST_BATCH_SIZE, INGEST_STREAM, INGEST_MODES, SOURCE_URL
+from connections import get_client, RESPONSES_DB
+from query import filter_incidents, decode_cursor
+from snapshot import snapshot_filter_incidents
+from plots import TIME_GRANULARITIES, IMAGE_FORMATS, MIN_DPI, MAX_DPI, load_grid_counts
+from cube import GRID_BBOX, GRID_CELL, GRID_SHAPE
+from response_cache import response_key, get_response, put_response, clear_responses
+from scan import scan_keys, iter_values
+from dataset import get_dataset_version, score_range, get_incident, incidents_published_at, get_issue_counts, \
+        get_stats, clear_dataset, PUBLISHED_KEY, UPDATED_KEY, LATITUDE_KEY, LONGITUDE_KEY, INGEST_LOCK_KEY, \
+        INGEST_LOCK_TIMEOUT
+from redis.exceptions import LockError
+from typing import Callable, List, Tuple
 import time
 import geopy.distance
 import os
@@ -11,16 +22,17 @@ import json
 ########################
 ### GLOBAL VARIABLES ###
 ########################
-source_url = 'https://data.austintexas.gov/api/views/dx9v-zd7x/rows.json?accessType=DOWNLOAD'
-redis_url = os.environ.get('REDIS_HOSTNAME', '127.0.0.1')
-redis_port = 6379
-redis_db = 0
+source_url = SOURCE_URL
+delete_lock_wait = 10 # seconds DELETE /incidents waits for a running ingest
+heatmap_lock_wait = 2 # seconds GET /incidents/heatmap waits for a running ingest when the count cube must be built
 flask_url = '0.0.0.0'
 flask_port = 5000
-AUSTIN_LAT = 30.2672
-AUSTIN_LON = -97.7431
-LAT_TOL = 5
-LON_TOL = 5
+flask_debug = os.environ.get('FLASK_DEBUG', 'false').lower() in ('1', 'true', 'yes')
+# 'snapshot': vectorized filtering on an in-process copy of the dataset (see snapshot.py)
+# 'index': filtering with the redis secondary indexes (see query.py)
+query_engine = os.environ.get('QUERY_ENGINE', 'snapshot')
+# share cached GET /incidents responses between API processes through redis db 4 (see response_cache.py)
+response_cache_redis = os.environ.get('RESPONSE_CACHE_REDIS', 'false').lower() in ('1', 'true', 'yes')
 PLOT_LAT_MIN = 30.0
 PLOT_LAT_MAX = 31.1
 PLOT_LON_MIN = -98.9
@@ -47,15 +59,6 @@ def message_payload(msg:str, success:bool=True, stat_code=200):
     """
     return {"message": msg, "success":success, "status code":stat_code}
 
-def get_redis_client(the_url: str, the_port: int, the_db: int) -> redis:
-    """Returns the Redis database client.
-    This function returns a Redis object permitting access to a Redis client
-    via 127.0.0.1:6379. The object specifically manipulates database 0. It is
-    set to decode responses from the client from bytes to Python strings.
-    """
-    return redis.Redis(host = the_url, port = the_port, db = the_db, \
-            decode_responses = True)
-
 
 
 def get_seconds(time_string) -> float:
@@ -141,7 +144,7 @@ def get_query_params() -> dict:
             - Dictionary object that pairs each query_parameter (key) with its associated value (inputted by the user).
                 The dictionary keys are as follows: 
                     - "incident_type", "status", "radius", "date_range", "time_range",
-                       "longitude", "latitude", "limit", "offest" 
+                       "longitude", "latitude", "limit", "offest", "cursor" 
             - If an error has occured a tuple of length two is returned containing an error message and a status code
     """
     # Query Parameters
@@ -191,6 +194,14 @@ def get_query_params() -> dict:
         return (message_payload(f"Error getting limit and offset parameters: {e}", False, 404), 404)
     if offset < 0 or limit < 0:
         return (message_payload(f"Error: limit and offset input parameters must be positive integers only",False, 404), 404)
+
+    # cursor returned with a previous page (X-Next-Cursor header)
+    cursor = request.args.get("cursor")
+    if cursor:
+        try:
+            decode_cursor(cursor)
+        except ValueError as e:
+            return (message_payload(f"Invalid 'cursor' input parameter: {e}", False, 404), 404)
     
     return {"incident_type":incident_type,
             "status":status,
@@ -201,6 +212,7 @@ def get_query_params() -> dict:
             "lattitude":lattitude,
             "offset":offset,
             "limit":limit,
+            "cursor":cursor,
     }
 
 
@@ -224,123 +236,150 @@ def filter_jobs(params:dict) -> List[dict]:
     # Lambda functions defined below help filter jobs by job_type and status
     is_type = lambda job : params['job_type'].lower() in job.get("job_type").lower() or params['job_type'].lower() == "all"
     is_status = lambda job : job.get("status").lower() == params['status'].lower() or params['status'].lower() == "all"
-    print(f"found keys: {rd_details.keys()}")
     # first retrieve all jobs 
     try:
-        all_jobs = [json.loads(rd_details.get(key)) 
-                    for key in rd_details.keys()[params["offset"]: params["offset"] + params["limit"]]]
+        all_jobs = [json.loads(value) for _, value in iter_values(rd_details, scan_keys(rd_details))
+                    if value is not None]
     except Exception as e:
         print("ERROR retrieving all jobs from redis database: {e}")
         return 
     print("retrieved jobs:", all_jobs)
-    # then filter jobs by type and status and return 
-    return [job for job in all_jobs if is_type(job) and is_status(job)]
+    # then filter jobs by type and status, and only then apply offset + limit
+    jobs = [job for job in all_jobs if is_type(job) and is_status(job)]
+    return jobs[params["offset"]: params["offset"] + params["limit"]]
 
 
 
 
-def post_incidents_data()-> None:
+def post_incidents_data(batch_size:int=INGEST_BATCH_SIZE, stream:bool=INGEST_STREAM,
+                        source:str=None, delta:bool=False)-> int:
     """
     Description:
     -----------
     Helper function to save the entire Austin traffic incidents dataset
-    into the redis database
+    into the redis database (see ingest.load_incidents)
 
     Args:
     -----------
+    batch_size(int): number of incidents written per redis round-trip
+    stream(bool): parse the download incrementally instead of loading the
+        whole payload in memory first
+    source(str): url or local path of the rows.json payload (defaults to source_url)
+    delta(bool): only upsert incidents published or updated since the last
+        refresh (see ingest.changed_since)
     
     Returns:
     -----------
-    None
-    """
-    global rd, source_url, AUSTIN_LAT, AUSTIN_LON, LAT_TOL, LON_TOL
-    the_json = requests.get(url = source_url).json()
-    cols = []
-    flags = []
-    for col_json in the_json['meta']['view']['columns']:
-        cols.append(col_json['fieldName'].replace(':', ''))
-        flags.append(col_json.get('flags'))
-    data = the_json['data']
-    jj = 0 # Only for indexing purposes
-    for datum in data:
-        key = datum[cols.index('traffic_report_id')]
-        for ii in range(0, len(cols)):
-            if datum[ii] == None:
-                datum[ii] = ''
-            # Data cleaning
-            if (cols[ii] == 'latitude' \
-                    and datum[ii].replace('.', '').isnumeric()) \
-                    and abs(float(datum[ii]) - AUSTIN_LAT) > LAT_TOL:
-                        datum[ii] = ''
-                        try:
-                            ind = datum.index('longitude')
-                            datum[ind] = ''
-                            rd.hset(key, cols[ind], datum[ind])
-                        except:
-                            pass
-            elif (cols[ii] == 'longitude' \
-                    and datum[ii].replace('.', '').isnumeric()) \
-                    and abs(float(datum[ii]) - AUSTIN_LON) > LON_TOL:
-                        datum[ii] = ''
-                        try:
-                            ind = datum.index('latitude')
-                            datum[ind] = ''
-                            rd.hset(key, cols[ind], datum[ind])
-                        except:
-                            pass
-            # Restrict columns to non-hidden ones
-            if flags[ii] is None or 'hidden' not in flags[ii]:
-                rd.hset(key, cols[ii], datum[ii])
-        jj = jj + 1
-        if jj % 1000 == 0:
-            print(f'{jj} entries posted')
-
-
-
-
-def filter_incidents_data(params:dict) -> list:
+    Number of incidents posted (int)
+    """
+    global rd, rd_staging, rd_locks, source_url
+    return load_incidents(rd, rd_staging, rd_locks, batch_size, stream, source or source_url, delta)
+
+
+
+
+def filter_incidents_data(params:dict) -> Tuple[list, str]:
     """
     Description:
     -----------
     Helper function easily filters through entire dataset
-    and returns the resulting filtered list 
+    and returns one page of the resulting filtered list 
 
     Args:
     -----------
     params(dict): Query parameters returned from the get_query_params() 
         containing the following keys:
             - "incident_type", "status", "radius", "date_range", "time_range",
-                        "longitude", "latitude", "limit", "offest"
+                        "longitude", "latitude", "limit", "offest", "cursor"
 
     Returns:
     -----------
-    List of incidents filtered based on their query parameters
+    Tuple of the incidents filtered based on their query parameters (list) and
+    the cursor of the next page (string, None if this is the last page)
     """
     global rd
-    # defining lambda function to help filter data in a more readable manner
-    is_incident_type = lambda params, incident: (params["incident_type"].lower() == "all" 
-                                       or incident["issue_reported"].lower() == params["incident_type"].lower())
-    is_incident_status = lambda params, incident: (params["status"].lower() == "all" 
-                                         or  incident["traffic_report_status"].lower() == params["status"].lower())
-    is_in_time_range = lambda params, incident: (get_seconds(params["start_date"]) <= float(incident["published_date"]) <= get_seconds(params["end_date"]))
-    
-    in_bounds = lambda params, incident: is_in_bounds(incident=incident, 
-                            radius_range=params["radius"], 
-                            lng=params["longitude"], 
-                            lat=params["lattitude"])
-    # filtering data using list comprehension and defined lambda functions
+    # dates are parsed once per request, the rest of the work happens in snapshot.py/query.py
     print("getting data")
-    data = [rd.hgetall(key) for key in rd.keys()[params["offset"]:params["offset"] + params["limit"]] # truncating + offsetting
-            if is_incident_type(params, rd.hgetall(key))
-             and is_incident_status(params, rd.hgetall(key))
-              and is_in_time_range(params, rd.hgetall(key))
-               and  in_bounds(params, rd.hgetall(key))]
+    engine = snapshot_filter_incidents if query_engine == 'snapshot' else filter_incidents
+    data, next_cursor = engine(rd, params["incident_type"], params["status"],
+                            get_seconds(params["start_date"]), get_seconds(params["end_date"]),
+                            params["radius"], params["longitude"], params["lattitude"],
+                            params["offset"], params["limit"], params["cursor"])
     print("succcesfully got data!")
-    # truncating data based on offset and limit parameters
-    return data
+    return data, next_cursor
+
+
+def check_job_params(params:dict) -> str:
+    """
+    Description:
+    -----------
+    Checks the parameters sent with a job before it is queued
+
+    Args:
+    -----------
+    params(dict): job parameters (granularity, format, dpi, mode, ...)
+
+    Returns:
+    -----------
+    Description of the first invalid parameter (string), None if they are all valid
+    """
+    if params.get("granularity", "year") not in TIME_GRANULARITIES:
+        return f"invalid granularity: {params['granularity']}. Expected one of: {', '.join(TIME_GRANULARITIES)}"
+    if params.get("format", "png") not in IMAGE_FORMATS:
+        return f"invalid format: {params['format']}. Expected one of: {', '.join(IMAGE_FORMATS)}"
+    if params.get("format") == "svg" and IMAGE_STORE == "imgur":
+        return "svg images can not be uploaded to imgur"
+    dpi = params.get("dpi", MIN_DPI)
+    if isinstance(dpi, bool) or not isinstance(dpi, (int, float)) or not MIN_DPI <= dpi <= MAX_DPI:
+        return f"invalid dpi: {dpi}. Expected a number between {MIN_DPI} and {MAX_DPI}"
+    if params.get("mode", "full") not in INGEST_MODES:
+        return f"invalid mode: {params['mode']}. Expected one of: {', '.join(INGEST_MODES)}"
+    return None
+
+
+def page_headers(next_cursor:str) -> dict:
+    """Response headers pointing clients to the next page of a filtered query."""
+    return {"X-Next-Cursor": next_cursor} if next_cursor else {}
+
+
+def cached_response(route:str, params:dict, build:Callable[[], Tuple]):
+    """
+    Description:
+    -----------
+    Serves a GET response from the response cache (see response_cache.py).
+    The cache key is also the ETag of the response: a client sending it back
+    in If-None-Match gets a 304 without the response being looked up or built.
+
+    Args:
+    -----------
+    route(str): name of the endpoint
+    params(dict): query parameters returned from get_query_params()
+    build(function): computes the (body, headers) of the response on a cache miss
+
+    Returns:
+    -----------
+    Flask response tuple (body, status code, headers)
+    """
+    global rd, response_rd, response_version
+    version = get_dataset_version(rd)
+    if version != response_version:
+        # the responses of the previous dataset can no longer be requested, free their memory
+        clear_responses()
+        response_version = version
+    key = response_key(route, params, version)
+    headers = {"ETag": f'"{key}"'}
+    if key in request.if_none_match:
+        return "", 304, headers
+    cached = get_response(key, response_rd)
+    if cached is None:
+        cached = build()
+        put_response(key, *cached, client=response_rd)
+    body, page = cached
+    return body, 200, {**page, **headers}
 
 app = Flask(__name__)
-rd = get_redis_client(redis_url, redis_port, redis_db)
+response_rd = get_client(RESPONSES_DB) if response_cache_redis else None
+response_version = None # dataset version of the responses cached in memory
 
 
 
@@ -426,7 +465,10 @@ def incidents():
         if len(params) == 2: return params # params is only of length 2 if an error as occured.
         try:
             print(f"trying to filter incidents by parameters {params}")
-            return filter_incidents_data(params)
+            def build():
+                data, next_cursor = filter_incidents_data(params)
+                return data, page_headers(next_cursor)
+            return cached_response("incidents", params, build)
         except Exception as e:
             print(f'ERROR: unable to get data\n{e}')
             return f'ERROR: unable to get data\n', 400
@@ -439,7 +481,13 @@ def incidents():
             return f'ERROR: unable to post data\n', 400
     elif request.method == 'DELETE':
         try:
-            rd.flushdb()
+            lock = rd_locks.lock(INGEST_LOCK_KEY, timeout=INGEST_LOCK_TIMEOUT)
+            if not lock.acquire(blocking_timeout=delete_lock_wait):
+                return 'ERROR: the dataset is being reloaded, try again later\n', 409
+            try:
+                clear_dataset(rd)
+            finally:
+                lock.release()
             return 'Data successfully deleted', 200
         except Exception as e:
             print(f'ERROR: unable to delete data\n{e}')
@@ -454,26 +502,32 @@ def incident_at_published_date(published_date):
  -----------
  This function returns the incident and all its information at a specified published_date.
  If the published_date is undetected, an error message with a 404 status code will be returned.
+ Several incidents can share a published_date, use the query parameter all=true to get all of them.
  Args
  ----
  published_date: user specified published_date time
  Returns
  -------
  incident: (dict) the incident and its information identified at a specified published_date 
+   (list of dicts ordered by id if all=true)
  """
  global rd
 
- for key in rd.keys():
-   try:
-    incident = rd.hgetall(key)
-    if incident['published_date'] == published_date:
-      return incident
-
-   except:
-    print('ERROR: unable to retrieve incident from redis database')
-    return message_payload('ERROR: unable to retrieve incident from redis database.', False, 500), 500
-
- return message_payload("ERROR: unable to retrieve incident using published_date: {published_date}", False, 404), 404
+ try:
+   published_seconds = float(published_date)
+ except ValueError:
+   return message_payload(f"ERROR: published_date must be a number of seconds, got: {published_date}", False, 404), 404
+ try:
+   incidents = incidents_published_at(rd, published_seconds)
+ except:
+   print('ERROR: unable to retrieve incident from redis database')
+   return message_payload('ERROR: unable to retrieve incident from redis database.', False, 500), 500
+
+ if not incidents:
+   return message_payload(f"ERROR: unable to retrieve incident using published_date: {published_date}", False, 404), 404
+ if request.args.get("all", "false").lower() == "true":
+   return incidents
+ return incidents[0]
 
 # routes to help people form queries
 @app.route('/incidents/ids', methods = ['GET'])
@@ -498,8 +552,10 @@ def ids():
     try:
         params = get_query_params()
         if len(params) == 2: return params # len of params is only 2 if an error has occured
-        data = filter_incidents_data(params)
-        return [incident['traffic_report_id'] for incident in data]
+        def build():
+            data, next_cursor = filter_incidents_data(params)
+            return [incident['traffic_report_id'] for incident in data], page_headers(next_cursor)
+        return cached_response("ids", params, build)
     except Exception as e:
         print(f'ERROR: unable to get IDs\n{e}')
         return f'ERROR: unable to get IDs', 400
@@ -509,18 +565,32 @@ def ids():
 
 @app.route("/incidents/ids/<id>")
 def get_incident_by_id(id):
+    """/incidents/ids/<id> endpoint
+    Description
+    -----------
+    This function returns the incident with the given traffic_report_id, looked
+    up directly by key. If there is no such incident, an error message with a
+    404 status code is returned.
+
+    Args:
+    -----------
+        id: traffic_report_id of the incident (string)
+
+    Returns:
+    -----------
+        The incident (dict)
+    """
     global rd
 
-    for key in rd.keys():
-        try:
-            incident = rd.hgetall(key)
-            if incident["traffic_report_id"] == id:
-                return incident
-        except:
-            print("Unable to retrieve ids from redis database")
-            return message_payload("Unable to retrieve ids from redis database. Please try again later", False, 500), 500
+    try:
+        incident = get_incident(rd, id)
+    except:
+        print("Unable to retrieve ids from redis database")
+        return message_payload("Unable to retrieve ids from redis database. Please try again later", False, 500), 500
+    if incident:
+        return incident
     
-    return message_payload("ERROR: No incident exists with the id: {id}", False, 404), 404
+    return message_payload(f"ERROR: No incident exists with the id: {id}", False, 404), 404
         
 
 
@@ -550,12 +620,62 @@ def published_dates():
  if len(params) == 2: return params # params is only length of 2 if an error has occured
  ## set param fields to a fixed value here ##
  
- filtered_incidents = filter_incidents_data(params)
- return [incident.get("published_date") for incident in filtered_incidents 
-         if incident.get("published_date") is not None]
+ def build():
+   filtered_incidents, next_cursor = filter_incidents_data(params)
+   return [incident.get("published_date") for incident in filtered_incidents 
+           if incident.get("published_date") is not None], page_headers(next_cursor)
+ return cached_response("published_dates", params, build)
+
 
 
 
+@app.route('/incidents/heatmap', methods = ['GET'])
+def heatmap_counts():
+    """/incidents/heatmap endpoint
+    Description
+    -----------
+    Returns the number of incidents per grid cell of the heatmap plots, for
+    incidents published between the start_date and end_date query parameters.
+    Counts come from the count cube (see cube.py).
+
+    Args:
+    -----------
+        None (query parameters: start_date, end_date, format=json|binary)
+
+    Returns:
+    -----------
+        - format=json: dict with the bounding box, cell size, grid shape and
+            the counts as a list of rows (one per longitude bin, one value per latitude bin)
+        - format=binary: the counts as little endian uint32, row major in the
+            same order, with the grid described by X-Grid-* headers
+    """
+    global rd
+    params = get_query_params()
+    if len(params) == 2: return params # params is only length of 2 if an error has occured
+    output = request.args.get("format", "json").lower()
+    if output not in ("json", "binary"):
+        return message_payload(f"ERROR: format must be json or binary, got: {output}", False, 400), 400
+    try:
+        counts = load_grid_counts(rd, rd_locks, get_seconds(params["start_date"]), get_seconds(params["end_date"]),
+                                  heatmap_lock_wait)
+    except LockError:
+        # the count cube must be built and an ingest holds the lock, do not tie up a request thread
+        return message_payload('ERROR: the dataset is being reloaded, try again later', False, 503), 503
+    except Exception as e:
+        print(f'ERROR: unable to get heatmap counts\n{e}')
+        return message_payload('ERROR: unable to get heatmap counts', False, 500), 500
+    if output == "binary":
+        return counts.astype('<u4').tobytes(), 200, {
+            "Content-Type": "application/octet-stream",
+            "X-Grid-Shape": f"{GRID_SHAPE[0]},{GRID_SHAPE[1]}",
+            "X-Grid-BBox": ",".join(str(bound) for bound in GRID_BBOX),
+            "X-Grid-Cell": str(GRID_CELL)}
+    return {"bbox": list(GRID_BBOX),
+            "cell": GRID_CELL,
+            "shape": list(GRID_SHAPE),
+            "total": int(counts.sum()),
+            "counts": counts.tolist()}
+
 
 # /issues
 @app.route('/incidents/issues', methods = ['GET'])
@@ -565,8 +685,9 @@ def issues():
     Description
     -----------
     This function returns a list of all unique issues reported in the
-    database. If there is an error, a descriptive string will be returned with
-    a 404 status code. 
+    database, most frequent first. The counts are maintained at ingest (see
+    /incidents/stats). If there is an error, a descriptive string will be
+    returned with a 404 status code. 
 
     Args:
     -----------
@@ -577,12 +698,8 @@ def issues():
     """
     global rd
     try:
-        result = []
-        for key in rd.keys():
-            value = rd.hget(key, 'issue_reported')
-            if value not in result:
-                result.append(value)
-        return result
+        counts = get_issue_counts(rd)
+        return sorted(counts, key=counts.get, reverse=True)
     except Exception as e:
         print(f'ERROR: unable to get IDs\n{e}')
         return f'ERROR: unable to get IDs', 400
@@ -613,15 +730,7 @@ def published_range():
     """
     global rd
     try:
-        the_min = float('inf')
-        the_max = float('-inf')
-        for key in rd.keys():
-            value = int(rd.hget(key, 'published_date'))
-            if value < the_min:
-                the_min = value
-            if value > the_max:
-                the_max = value
-        return {'min' : the_min, 'max' : the_max}
+        return score_range(rd, PUBLISHED_KEY)
     except Exception as e:
         print(f'ERROR: unable to get published range\n{e}')
         return f'ERROR: unable to get published range', 400
@@ -652,15 +761,7 @@ def updated_range():
     """
     global rd
     try:
-        the_min = float('inf')
-        the_max = float('-inf')
-        for key in rd.keys():
-            value = int(rd.hget(key, 'traffic_report_status_date_time'))
-            if value < the_min:
-                the_min = value
-            if value > the_max:
-                the_max = value
-        return {'min' : the_min, 'max' : the_max}
+        return score_range(rd, UPDATED_KEY)
     except Exception as e:
         print(f'ERROR: unable to get updated range\n{e}')
         return f'ERROR: unable to get updated range', 400
@@ -691,30 +792,8 @@ def coordinates_range():
     """
     global rd
     try:
-        min_lat = float('inf')
-        max_lat = float('-inf')
-        min_lon = float('inf')
-        max_lon = float('-inf')
-        for key in rd.keys():
-            lat = rd.hget(key, 'latitude')
-            lon = rd.hget(key, 'longitude')
-            try:
-                lat = float(lat)
-                lon = float(lon)
-            except:
-                continue
-            if lat < min_lat:
-                min_lat = lat
-            if lat > max_lat:
-                max_lat = lat
-            if lon < min_lon:
-                min_lon = lon
-            if lon > max_lon:
-                max_lon = lon
-        return { \
-                'lat' : {'min' : min_lat, 'max' : max_lat}, \
-                'lon' : {'min' : min_lon, 'max' : max_lon} \
-                }
+        return {'lat' : score_range(rd, LATITUDE_KEY, float),
+                'lon' : score_range(rd, LONGITUDE_KEY, float)}
     except Exception as e:
         print(f'ERROR: unable to get coordinates range\n{e}')
         return f'ERROR: unable to get coordinates range', 400
@@ -722,6 +801,38 @@ def coordinates_range():
 
 
 
+# /stats
+@app.route('/incidents/stats', methods = ['GET'])
+def stats():
+    """/stats endpoint
+
+    Description
+    -----------
+    This function returns the aggregate statistics of the database, which are
+    maintained at ingest: number of incidents, number of incidents per issue,
+    published and updated date ranges and the coordinates bounding box. If
+    there is an error, a descriptive string will be returned with a 400
+    status code.
+
+    Args:
+    ----------
+        None
+
+    Returns:
+    ----------
+        The statistics as a dictionary with the keys count, issues, published,
+        updated and coordinates.
+    """
+    global rd
+    try:
+        return get_stats(rd)
+    except Exception as e:
+        print(f'ERROR: unable to get stats\n{e}')
+        return f'ERROR: unable to get stats', 400
+
+
+
+
 @app.route("/jobs", methods=["GET", "DELETE"])
 def jobs():
     """
@@ -794,9 +905,14 @@ See /help for more assistance", False, 404), 404
             print(f"ERROR: an unexpected error has occured {e}")
             return message_payload(f"ERROR: Unable to fufill job request: {e}", False, 500), 500
         job_type = path[-1] if path[-2] != "plot" else "plot-" + path[-1] # getting job_type from route path
+        # any other field of the request body is kept as a job parameter (e.g. {"mode": "delta"})
+        job_params = {key: value for key, value in job.items() if key not in ("start", "end")}
+        error = check_job_params(job_params)
+        if error:
+            return message_payload(f"ERROR: {error}. See /help for more assistance", False, 400), 400
         # add job to queue based on job_type (aka...path of the request)
         print(f"adding job: {job}")
-        return json.dumps(add_job(job["start"], job["end"], job_type))
+        return json.dumps(add_job(job["start"], job["end"], job_type, params=job_params))
     # else if user wants to get jobs
     elif request.method == "GET":
         params = get_query_params()
@@ -831,6 +947,38 @@ def get_unique_job(jid):
         return message_payload(f"Job with jid: {jid} does not exist")
 
 
+@app.route("/jobs/jids/<jid>/image", methods=["GET"])
+def get_job_image(jid):
+    """/jobs/jids/<jid>/image endpoint
+    Description
+    -----------
+    Returns the image made by a plot job, straight from the image store
+    (see image_store.py). Images uploaded to imgur are redirected to.
+
+    Args:
+    -----------
+        jid(str): job id
+
+    Returns:
+    -----------
+        The image bytes with their content type, or a 404 error message if the
+        job does not exist or has no image (yet)
+    """
+    try:
+        job = get_job_by_id(jid)
+    except Exception as e:
+        return message_payload(f"Error: Unable to find job with job id '{jid}': {e}", False, 404), 404
+    results = job.get("results") or {}
+    if "id" not in results:
+        return message_payload(f"Job with jid: {jid} has no image, its status is: {job.get('status')}", False, 404), 404
+    if results.get("store", "imgur") == "imgur":
+        return redirect(results["link"])
+    image, content_type = load_image(rd_images, results)
+    if image is None:
+        return message_payload(f"The image of job with jid: {jid} was deleted", False, 404), 404
+    return image, 200, {"Content-Type": content_type}
+
+
 
 
 
@@ -857,4 +1005,5 @@ def get_job_ids():
 
 
 if __name__ == '__main__':
-    app.run(host = flask_url, debug = True)
+    # development server, production runs gunicorn (see gunicorn.conf.py)
+    app.run(host = flask_url, port = flask_port, debug = flask_debug)
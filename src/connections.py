@@ -0,0 +1,138 @@
+import asyncio
+import os
+import redis
+import redis.asyncio
+# connections.py
+# Every redis connection of the API, the worker and the job helpers comes
+# from here: connection pools created once per process and shared by all
+# its modules and threads, the synchronous ones of get_pool() and the
+# redis.asyncio ones of get_async_pool() (concurrent reads of the
+# incidents, see async_fetch.py). Pools are bounded and block (up to
+# REDIS_POOL_TIMEOUT seconds) when all their connections are busy: a
+# process opens at most REDIS_MAX_CONNECTIONS connections per synchronous
+# pool and ASYNC_MAX_CONNECTIONS per asynchronous pool. Per replica, that
+# is at most
+# (API_WORKERS + WORKER_PROCESSES) * (REDIS_MAX_CONNECTIONS + ASYNC_MAX_CONNECTIONS)
+# connections to db 0, the only one read asynchronously,
+# (API_WORKERS + WORKER_PROCESSES) * 2 * REDIS_MAX_CONNECTIONS to db 1 (the
+# blocking pool of the job queue, the pool of the ingest lock) and
+# (API_WORKERS + WORKER_PROCESSES) * REDIS_MAX_CONNECTIONS to the others.
+# Pools reset themselves in forked processes and are closed by
+# close_pools() when a process shuts down.
+#
+# REDIS DB'S
+# 0: traffic data
+# 1: job queue (ids only) and the ingest lock (see dataset.INGEST_LOCK_KEY)
+# 2: job details and results (job id, status, parameters)
+# 3: results of finished plot jobs, reused by identical jobs (see result_cache.py)
+# 4: cached GET /incidents responses, if shared (see response_cache.py)
+# 5: images of the plot jobs (see image_store.py)
+# 6: staging copy of db 0 while a full refresh loads (see dataset.publish_dataset)
+
+########################
+### GLOBAL VARIABLES ###
+########################
+REDIS_HOST = os.environ.get('REDIS_HOSTNAME', '127.0.0.1')
+REDIS_PORT = int(os.environ.get('REDIS_PORT', 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 16)) # per database and process
+REDIS_POOL_TIMEOUT = float(os.environ.get('REDIS_POOL_TIMEOUT', 20)) # seconds waited for a free connection
+REDIS_SOCKET_TIMEOUT = float(os.environ.get('REDIS_SOCKET_TIMEOUT', 30)) # seconds, per command
+REDIS_CONNECT_TIMEOUT = float(os.environ.get('REDIS_CONNECT_TIMEOUT', 5)) # seconds
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30)) # seconds idle before a PING
+REDIS_RETRY_ON_TIMEOUT = os.environ.get('REDIS_RETRY_ON_TIMEOUT', 'true').lower() in ('1', 'true', 'yes')
+ASYNC_MAX_CONNECTIONS = int(os.environ.get('ASYNC_MAX_CONNECTIONS', 32)) # per database and process
+INCIDENTS_DB = 0
+QUEUE_DB = 1
+JOBS_DB = 2
+RESULTS_DB = 3
+RESPONSES_DB = 4
+IMAGES_DB = 5
+STAGING_DB = 6
+_pools = {}
+_async_pools = {}
+_async_pools_pid = None
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def get_pool(db:int, decode_responses:bool=True, blocking_commands:bool=False) -> redis.ConnectionPool:
+    """
+    Description:
+    -----------
+        - Returns the connection pool of a database, created on first use
+
+    Args:
+    -----------
+        - db: number of the database (int)
+        - decode_responses: decode replies to strings (bool)
+        - blocking_commands: the pool serves commands that wait on the server
+            (BLPOP of the job queue), its connections have no socket timeout
+
+    Returns:
+    -----------
+        - redis.BlockingConnectionPool
+    """
+    key = (db, decode_responses, blocking_commands)
+    if key not in _pools:
+        _pools[key] = redis.BlockingConnectionPool(
+                host=REDIS_HOST, port=REDIS_PORT, db=db, decode_responses=decode_responses,
+                max_connections=REDIS_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=None if blocking_commands else REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_CONNECT_TIMEOUT, socket_keepalive=True,
+                health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                retry_on_timeout=REDIS_RETRY_ON_TIMEOUT and not blocking_commands)
+    return _pools[key]
+
+
+def get_client(db:int, decode_responses:bool=True) -> redis.Redis:
+    """Returns a redis client of database `db` backed by the shared pool of the process (see get_pool())."""
+    return redis.Redis(connection_pool=get_pool(db, decode_responses))
+
+
+def get_async_pool(db:int, decode_responses:bool=True) -> redis.asyncio.ConnectionPool:
+    """
+    Description:
+    -----------
+        - Returns the redis.asyncio connection pool of a database, created on
+            first use with the settings of get_pool(). Must be called from the
+            event loop that uses the pool (see async_fetch._event_loop()).
+
+    Args:
+    -----------
+        - db: number of the database (int)
+        - decode_responses: decode replies to strings (bool)
+
+    Returns:
+    -----------
+        - redis.asyncio.BlockingConnectionPool
+    """
+    global _async_pools_pid
+    if _async_pools_pid != os.getpid():
+        # the pools of the parent belong to its event loop
+        _async_pools.clear()
+        _async_pools_pid = os.getpid()
+    key = (db, decode_responses)
+    if key not in _async_pools:
+        pool = redis.asyncio.BlockingConnectionPool(
+                host=REDIS_HOST, port=REDIS_PORT, db=db, decode_responses=decode_responses,
+                max_connections=ASYNC_MAX_CONNECTIONS, timeout=REDIS_POOL_TIMEOUT,
+                socket_timeout=REDIS_SOCKET_TIMEOUT, socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+                socket_keepalive=True, health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+                retry_on_timeout=REDIS_RETRY_ON_TIMEOUT)
+        _async_pools[key] = (pool, asyncio.get_running_loop())
+    return _async_pools[key][0]
+
+
+def close_pools() -> None:
+    """
+    Closes every connection of the pools of this process when it shuts down
+    (see worker.py and the worker_exit hook of gunicorn.conf.py).
+    """
+    for pool in _pools.values():
+        pool.disconnect()
+    if _async_pools_pid != os.getpid():
+        return
+    for pool, loop in _async_pools.values():
+        if loop.is_running():
+            asyncio.run_coroutine_threadsafe(pool.disconnect(), loop).result(timeout=REDIS_SOCKET_TIMEOUT)
+    _async_pools.clear()
@@ -0,0 +1,95 @@
+import datetime
+import numpy as np
+from typing import Optional, Tuple
+# cube.py
+# Spatio-temporal count cube behind the heatmaps: the number of incidents
+# per grid cell of GRID_CELL degrees over GRID_BBOX, per (local) day of
+# publication. Each day is a redis hash of cell index -> count, updated
+# with HINCRBY as incidents are written (see dataset.index_incident), so a
+# heatmap of any time window is a sum of daily slices.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+GRID_BBOX = (-98.9, -97.0, 30.0, 31.1) # min longitude, max longitude, min latitude, max latitude
+GRID_CELL = 0.01 # degrees
+GRID_SHAPE = (int((GRID_BBOX[1] - GRID_BBOX[0]) / GRID_CELL), int((GRID_BBOX[3] - GRID_BBOX[2]) / GRID_CELL))
+CUBE_DAY_KEY = 'cube:day:{}' # hash of cell index -> number of incidents published that day
+CUBE_DAYS_KEY = 'cube:days' # sorted set of the days with a slice, scored on the day
+CUBE_READY_KEY = 'cube:ready' # set once the cube holds every incident (see plots.load_grid_counts)
+EPOCH_DATE = datetime.date(1970, 1, 1)
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def grid_edges() -> Tuple[np.ndarray, np.ndarray]:
+    """Longitude and latitude bin edges of the grid, the ones np.histogram2d uses for GRID_BBOX."""
+    return (np.linspace(GRID_BBOX[0], GRID_BBOX[1], GRID_SHAPE[0] + 1),
+            np.linspace(GRID_BBOX[2], GRID_BBOX[3], GRID_SHAPE[1] + 1))
+
+
+def grid_cells(lat:np.ndarray, lon:np.ndarray) -> np.ndarray:
+    """
+    Description:
+    -----------
+        - Flat cell index (longitude bin * GRID_SHAPE[1] + latitude bin) of
+            each point, binned like np.histogram2d: bins are closed on the left,
+            the last one on both sides
+
+    Args:
+    -----------
+        - lat, lon: coordinates (NumPy arrays)
+
+    Returns:
+    -----------
+        - int64 array of cell indexes, -1 for points outside of GRID_BBOX
+    """
+    lon_edges, lat_edges = grid_edges()
+    lon = np.asarray(lon, dtype=np.float64)
+    lat = np.asarray(lat, dtype=np.float64)
+    x = np.searchsorted(lon_edges, lon, side='right') - 1
+    y = np.searchsorted(lat_edges, lat, side='right') - 1
+    x[lon == lon_edges[-1]] -= 1
+    y[lat == lat_edges[-1]] -= 1
+    inside = (x >= 0) & (x < GRID_SHAPE[0]) & (y >= 0) & (y < GRID_SHAPE[1])
+    return np.where(inside, x * GRID_SHAPE[1] + y, -1)
+
+
+def incident_day(published:float) -> int:
+    """Local day of publication, in days since 1970-01-01 (like datetime.datetime.fromtimestamp())."""
+    return (datetime.datetime.fromtimestamp(published).date() - EPOCH_DATE).days
+
+
+def day_start(day:int) -> float:
+    """Epoch seconds of the local midnight starting `day` (see incident_day())."""
+    date = EPOCH_DATE + datetime.timedelta(days=day)
+    return datetime.datetime.combine(date, datetime.time()).timestamp()
+
+
+def cube_entry(published:Optional[float], lat:Optional[float], lon:Optional[float]) -> Optional[Tuple[int, int]]:
+    """(day, cell) an incident is counted in, None if it is not on the grid or has no published_date."""
+    if published is None or lat is None or lon is None:
+        return None
+    cell = int(grid_cells(np.array([lat]), np.array([lon]))[0])
+    if cell < 0:
+        return None
+    return incident_day(published), cell
+
+
+def update_cube(pipe, old:Optional[Tuple[int, int]], new:Optional[Tuple[int, int]]) -> None:
+    """Queues the commands moving one incident from the `old` to the `new` (day, cell) of the cube."""
+    if old == new:
+        return
+    if old is not None:
+        pipe.hincrby(CUBE_DAY_KEY.format(old[0]), old[1], -1)
+    if new is not None:
+        pipe.hincrby(CUBE_DAY_KEY.format(new[0]), new[1], 1)
+        pipe.zadd(CUBE_DAYS_KEY, {new[0]: new[0]})
+
+
+def add_slice(counts:np.ndarray, cells:dict) -> None:
+    """Adds a day hash (cell index -> count, as returned by HGETALL) to flat grid counts."""
+    if cells:
+        index = np.fromiter((int(cell) for cell in cells), dtype=np.int64, count=len(cells))
+        values = np.fromiter((int(value) for value in cells.values()), dtype=np.int64, count=len(cells))
+        np.add.at(counts, index, values)
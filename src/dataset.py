@@ -0,0 +1,468 @@
+import os
+import uuid
+from scan import scan_set
+from cube import cube_entry, update_cube, CUBE_READY_KEY
+from storage import read_incidents, parse_stored, DICTIONARY_EPOCH_KEY, STORAGE_FORMAT
+from typing import Iterator, List, Tuple
+# dataset.py
+# Layout of the traffic incidents dataset in redis db 0.
+# Every incident is keyed on its traffic_report_id (see storage.py for how it
+# is laid out). Bookkeeping keys
+# (watermarks, indexes, ...) always contain a ':' so they can never collide
+# with an incident id.
+# Full refreshes are loaded into a staging database and swapped in at once
+# (see publish_dataset), readers only ever see complete datasets.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+WATERMARK_KEY = 'meta:watermark'
+VERSION_KEY = 'meta:version' # changes every time the dataset changes
+INGEST_LOCK_KEY = 'lock:ingest' # held while the dataset is written, kept outside of the swapped databases
+INGEST_LOCK_TIMEOUT = int(os.environ.get('INGEST_LOCK_TIMEOUT', 3600)) # seconds, released if an ingest dies
+WATERMARK_FIELDS = ('published_date', 'traffic_report_status_date_time')
+# secondary indexes maintained at ingest
+ALL_KEY = 'idx:all' # set of every incident id
+ISSUE_KEY = 'idx:issue:{}' # set of ids per (lower case) issue_reported
+STATUS_KEY = 'idx:status:{}' # set of ids per (lower case) traffic_report_status
+PUBLISHED_KEY = 'idx:published' # sorted set of ids scored on published_date
+UPDATED_KEY = 'idx:updated' # sorted set of ids scored on traffic_report_status_date_time
+GEO_KEY = 'idx:geo' # geo set of ids on (longitude, latitude)
+LATITUDE_KEY = 'idx:latitude' # sorted set of ids scored on latitude
+LONGITUDE_KEY = 'idx:longitude' # sorted set of ids scored on longitude
+# aggregate statistics maintained at ingest
+ISSUE_COUNTS_KEY = 'stats:issues' # hash of issue_reported -> number of incidents
+INDEXED_FIELDS = ('issue_reported', 'traffic_report_status', 'published_date',
+                  'traffic_report_status_date_time', 'latitude', 'longitude')
+QUERY_TMP_KEY = 'tmp:query:{}'
+QUERY_TMP_TTL = 60 # seconds, safety net for result sets of queries that were never read to the end
+QUERY_CHUNK_SIZE = 500
+# fetches every incident published at ARGV[1] in a single round-trip, ARGV[2] is the storage format
+PUBLISHED_AT_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[1], ARGV[1])
+local incidents = {}
+for i, id in ipairs(ids) do
+    if ARGV[2] == 'packed' then
+        incidents[i] = redis.call('GET', id) or ''
+    else
+        incidents[i] = redis.call('HGETALL', id)
+    end
+end
+return {redis.call('GET', KEYS[2]) or '', ids, incidents}
+"""
+# redis measures distances on a sphere while radius queries use geodesic distances
+# on the WGS-84 ellipsoid (up to ~0.5% apart): the geo search is widened by this
+# factor and the candidates are then checked exactly
+GEO_RADIUS_MARGIN = 1.01
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def incident_keys(client) -> Iterator[str]:
+    """
+    Description:
+    -----------
+        - Iterates over the keys of every incident stored in the database,
+            without blocking redis (SSCAN over the id index)
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - Iterator of incident keys (traffic_report_id strings)
+    """
+    return scan_set(client, ALL_KEY)
+
+
+def get_incident(client, key:str) -> dict:
+    """
+    Description:
+    -----------
+        - Direct lookup of an incident by id (the key of an incident is its
+            traffic_report_id), in a single round-trip
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - key: traffic_report_id (string)
+
+    Returns:
+    -----------
+        - Incident dictionary, or None if there is no incident with this id
+    """
+    if ':' in key: # bookkeeping keys are not incidents
+        return None
+    return read_incidents(client, [key])[0] or None
+
+
+def incidents_published_at(client, published_date:float) -> List[dict]:
+    """
+    Description:
+    -----------
+        - Returns every incident published at exactly `published_date`, using the
+            published_date index. The index lookup and the fetches run in one
+            server side script, so this costs a single round-trip.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - published_date: publication time in seconds (float)
+
+    Returns:
+    -----------
+        - List of incident dictionaries, ordered by id
+    """
+    script = client.register_script(PUBLISHED_AT_SCRIPT)
+    epoch, ids, stored = script(keys=[PUBLISHED_KEY, DICTIONARY_EPOCH_KEY],
+                                args=[repr(float(published_date)), STORAGE_FORMAT])
+    return parse_stored(client, ids, stored, epoch)
+
+
+def to_number(value):
+    """Converts a stored value into a float, or None if it is empty/not a number."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_dataset_version(client) -> str:
+    """Returns the current dataset version id ('' if the dataset was never versioned)."""
+    return client.get(VERSION_KEY) or ''
+
+
+def bump_dataset_version(client) -> str:
+    """
+    Description:
+    -----------
+        - Gives the dataset a new version id. Must be called after every change
+            to the incidents so that in-process snapshots and caches keyed on the
+            version are refreshed. Ids are random, so a version id is never
+            reused, even after the database was flushed.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - The new version id (string)
+    """
+    version = uuid.uuid4().hex
+    client.set(VERSION_KEY, version)
+    return version
+
+
+def publish_dataset(staging, staging_db:int, live_db:int) -> None:
+    """
+    Description:
+    -----------
+        - Makes the dataset loaded into the staging database the live one.
+            SWAPDB is atomic: every client of the live database switches from
+            the previous dataset to the complete new one (and its version) at
+            once. The previous dataset, now in the staging database, is then
+            dropped with FLUSHDB ASYNC, its memory is freed in the background.
+
+    Args:
+    -----------
+        - staging: redis client of the staging database
+        - staging_db, live_db: numbers of the staging and live databases (int)
+    """
+    staging.swapdb(live_db, staging_db)
+    staging.flushdb(asynchronous=True)
+
+
+def clear_dataset(client) -> str:
+    """
+    Description:
+    -----------
+        - Deletes every incident, index and statistic in one transaction.
+            FLUSHDB ASYNC unlinks the keys right away and frees their memory in
+            the background, so redis does not block on a large dataset.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - The version id of the empty dataset (string)
+    """
+    version = uuid.uuid4().hex
+    pipe = client.pipeline(transaction=True)
+    pipe.flushdb(asynchronous=True)
+    pipe.set(CUBE_READY_KEY, 1) # the empty count cube matches the empty dataset
+    pipe.set(VERSION_KEY, version)
+    pipe.execute()
+    return version
+
+
+def get_watermark(client) -> dict:
+    """
+    Description:
+    -----------
+        - Reads the newest published_date and traffic_report_status_date_time
+            seen by the last ingest
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - Dictionary pairing each field of WATERMARK_FIELDS with a float
+            (fields that were never recorded are left out)
+    """
+    stored = client.hgetall(WATERMARK_KEY)
+    watermark = {}
+    for field in WATERMARK_FIELDS:
+        value = to_number(stored.get(field))
+        if value is not None:
+            watermark[field] = value
+    return watermark
+
+
+def set_watermark(client, watermark:dict) -> None:
+    """Saves the watermark returned by get_watermark()/ingest.changed_since()."""
+    if watermark:
+        client.hset(WATERMARK_KEY, mapping=watermark)
+
+
+def get_indexed_values(client, keys:List[str], storage_format:str=STORAGE_FORMAT) -> List[dict]:
+    """
+    Description:
+    -----------
+        - Reads the currently stored INDEXED_FIELDS of several incidents in a
+            single round-trip, so that index entries of overwritten values can be removed
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - keys: incident keys (list of strings)
+        - storage_format: one of storage.STORAGE_FORMATS
+
+    Returns:
+    -----------
+        - One dictionary per key (empty values for incidents that do not exist yet)
+    """
+    return read_incidents(client, keys, INDEXED_FIELDS, storage_format)
+
+
+def index_incident(pipe, incident:dict, previous:dict=None) -> None:
+    """
+    Description:
+    -----------
+        - Queues the commands that add an incident to the secondary indexes and the
+            heatmap count cube (and remove it from the entries of its previous values) on a pipeline
+
+    Args:
+    -----------
+        - pipe: redis pipeline of the incidents database
+        - incident: incident dictionary being written
+        - previous: values returned by get_indexed_values() for this incident
+    """
+    key = incident['traffic_report_id']
+    previous = previous or {}
+    pipe.sadd(ALL_KEY, key)
+    for field, key_format in (('issue_reported', ISSUE_KEY), ('traffic_report_status', STATUS_KEY)):
+        old = previous.get(field)
+        new = incident.get(field, old)
+        if old and old != new:
+            pipe.srem(key_format.format(old.lower()), key)
+        if new:
+            pipe.sadd(key_format.format(str(new).lower()), key)
+        if field == 'issue_reported' and old != new:
+            if old:
+                pipe.hincrby(ISSUE_COUNTS_KEY, old, -1)
+            if new:
+                pipe.hincrby(ISSUE_COUNTS_KEY, new, 1)
+    for field, zset in (('published_date', PUBLISHED_KEY), ('traffic_report_status_date_time', UPDATED_KEY)):
+        score = to_number(incident.get(field, previous.get(field)))
+        if score is None:
+            pipe.zrem(zset, key)
+        else:
+            pipe.zadd(zset, {key: score})
+    lat = to_number(incident.get('latitude'))
+    lon = to_number(incident.get('longitude'))
+    if lat is None or lon is None or not (-85.05 <= lat <= 85.05 and -180 <= lon <= 180):
+        pipe.zrem(GEO_KEY, key) # a geo set is a sorted set underneath
+        pipe.zrem(LATITUDE_KEY, key)
+        pipe.zrem(LONGITUDE_KEY, key)
+    else:
+        pipe.geoadd(GEO_KEY, [lon, lat, key])
+        pipe.zadd(LATITUDE_KEY, {key: lat})
+        pipe.zadd(LONGITUDE_KEY, {key: lon})
+    update_cube(pipe,
+                cube_entry(to_number(previous.get('published_date')), to_number(previous.get('latitude')),
+                           to_number(previous.get('longitude'))),
+                cube_entry(to_number(incident.get('published_date', previous.get('published_date'))), lat, lon))
+
+
+def _range_after(client, zset:str, start:float, end:float, position:Tuple[float, str],
+                 count:int) -> List[Tuple[str, float]]:
+    """
+    Description:
+    -----------
+        - Reads up to `count` members of a sorted set scored between `start` and `end`,
+            resuming right after `position` (score, member). Members sharing a score are
+            ordered by name inside redis, which makes (score, member) a stable position.
+            Costs O(log N + count) whatever the position is.
+
+    Returns:
+    -----------
+        - List of (member, score) tuples
+    """
+    if position is None or position[0] < start:
+        return client.zrangebyscore(zset, start, end, start=0, num=count, withscores=True)
+    score, member = position
+    if score > end:
+        return []
+    pipe = client.pipeline(transaction=False)
+    pipe.zrangebyscore(zset, score, score, withscores=True)
+    pipe.zrangebyscore(zset, f'({score!r}', end, start=0, num=count, withscores=True)
+    ties, rest = pipe.execute()
+    return [(key, value) for key, value in ties if key > member] + rest
+
+
+def iter_query_ids(client, incident_type:str='all', status:str='all', start:float=float('-inf'),
+                   end:float=float('inf'), radius:float=float('inf'), lng:float=None,
+                   lat:float=None, after:Tuple[float, str]=None,
+                   chunk_size:int=QUERY_CHUNK_SIZE) -> Iterator[Tuple[str, float]]:
+    """
+    Description:
+    -----------
+        - Uses the secondary indexes to find the incidents matching an issue type,
+            a status, a published_date range and a search radius. The sets are
+            intersected inside redis and the matching ids are then read
+            `chunk_size` at a time, so a caller that stops early (e.g. a full
+            page) never transfers the rest of the result.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - incident_type: issue_reported to match, case insensitive ('all' matches everything)
+        - status: traffic_report_status to match, case insensitive ('all' matches everything)
+        - start, end: published_date bounds in seconds (inclusive)
+        - radius: search radius in miles around (lng, lat). The radius is widened by
+            GEO_RADIUS_MARGIN, so callers needing exact geodesic semantics must
+            still check the distance of the returned candidates
+        - after: (published_date, id) position to resume from, exclusive (see query.encode_cursor)
+        - chunk_size: number of ids read per round-trip (int)
+
+    Returns:
+    -----------
+        - Iterator of (id, published_date) tuples, ordered by published_date then id
+    """
+    sets = []
+    if incident_type.lower() != 'all':
+        sets.append(ISSUE_KEY.format(incident_type.lower()))
+    if status.lower() != 'all':
+        sets.append(STATUS_KEY.format(status.lower()))
+    source = PUBLISHED_KEY
+    tmp_key = None
+    if sets or radius != float('inf'):
+        # intersect the sets with the published_date sorted set, weights of 0 keep the
+        # published_date as the score of the result
+        tmp_key = QUERY_TMP_KEY.format(uuid.uuid4().hex)
+        pipe = client.pipeline(transaction=True)
+        if radius != float('inf'):
+            geo_key = tmp_key + ':geo'
+            pipe.geosearchstore(geo_key, GEO_KEY, longitude=lng, latitude=lat,
+                                radius=radius * GEO_RADIUS_MARGIN, unit='mi', storedist=True)
+            sets.append(geo_key)
+        weights = {PUBLISHED_KEY: 1}
+        weights.update({key: 0 for key in sets})
+        pipe.zinterstore(tmp_key, weights)
+        pipe.expire(tmp_key, QUERY_TMP_TTL)
+        if radius != float('inf'):
+            pipe.delete(geo_key)
+        pipe.execute()
+        source = tmp_key
+    try:
+        position = after
+        while True:
+            chunk = _range_after(client, source, start, end, position, chunk_size)
+            yield from chunk
+            if len(chunk) < chunk_size:
+                return
+            position = (chunk[-1][1], chunk[-1][0])
+    finally:
+        if tmp_key:
+            client.delete(tmp_key)
+
+
+def _queue_score_range(pipe, zset:str) -> None:
+    """Queues the two commands read by _read_score_range() on a pipeline."""
+    pipe.zrange(zset, 0, 0, withscores=True)
+    pipe.zrange(zset, -1, -1, withscores=True)
+
+
+def _read_score_range(lowest:list, highest:list, cast=int) -> dict:
+    """Turns the replies of _queue_score_range() into a {'min', 'max'} dictionary."""
+    if not lowest:
+        return {'min': float('inf'), 'max': float('-inf')}
+    return {'min': cast(lowest[0][1]), 'max': cast(highest[0][1])}
+
+
+def score_range(client, zset:str, cast=int) -> dict:
+    """
+    Description:
+    -----------
+        - Returns the smallest and largest score of a sorted set index in O(1)
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - zset: PUBLISHED_KEY, UPDATED_KEY, LATITUDE_KEY or LONGITUDE_KEY
+        - cast: type of the returned values (int for dates, float for coordinates)
+
+    Returns:
+    -----------
+        - Dictionary with 'min' and 'max' (or +/- infinity when the index is empty)
+    """
+    pipe = client.pipeline(transaction=False)
+    _queue_score_range(pipe, zset)
+    return _read_score_range(*pipe.execute(), cast=cast)
+
+
+def get_issue_counts(client) -> dict:
+    """Returns the number of incidents of every issue_reported present in the database."""
+    counts = client.hgetall(ISSUE_COUNTS_KEY)
+    return {issue: int(count) for issue, count in counts.items() if int(count) > 0}
+
+
+def get_stats(client) -> dict:
+    """
+    Description:
+    -----------
+        - Reads the aggregate statistics maintained at ingest (see index_incident())
+            in a single round-trip. Nothing is computed at request time.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - Dictionary with the following keys:
+            - count: number of incidents (int)
+            - issues: number of incidents per issue_reported (dict)
+            - published, updated: 'min' and 'max' dates in seconds (dicts)
+            - coordinates: 'lat' and 'lon' bounding box, each with 'min' and 'max' (dicts)
+    """
+    pipe = client.pipeline(transaction=True)
+    pipe.scard(ALL_KEY)
+    pipe.hgetall(ISSUE_COUNTS_KEY)
+    for zset in (PUBLISHED_KEY, UPDATED_KEY, LATITUDE_KEY, LONGITUDE_KEY):
+        _queue_score_range(pipe, zset)
+    replies = pipe.execute()
+    count, issues = replies[0], replies[1]
+    published, updated, lat, lon = [replies[ii:ii + 2] for ii in range(2, 10, 2)]
+    return {'count': count,
+            'issues': {issue: int(value) for issue, value in issues.items() if int(value) > 0},
+            'published': _read_score_range(*published),
+            'updated': _read_score_range(*updated),
+            'coordinates': {'lat': _read_score_range(*lat, cast=float),
+                            'lon': _read_score_range(*lon, cast=float)}}
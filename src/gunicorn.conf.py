@@ -0,0 +1,35 @@
+import os
+# gunicorn.conf.py
+# Production server of the API, run from the repository root (or / in the image):
+#     gunicorn -c src/gunicorn.conf.py atx_traffic:app
+# Every worker process imports atx_traffic on its own, its threads then share
+# the redis clients of the process (one connection pool per database), the
+# in-memory snapshot and the response cache. Each worker holds its own
+# snapshot: memory grows with API_WORKERS, requests served grow with
+# API_WORKERS * API_THREADS. On SIGTERM, workers stop accepting connections
+# and finish the requests in flight for up to API_GRACEFUL_TIMEOUT seconds,
+# then close their redis connections (worker_exit).
+
+########################
+### GLOBAL VARIABLES ###
+########################
+bind = f"0.0.0.0:{os.environ.get('API_PORT', 5000)}"
+pythonpath = os.path.dirname(os.path.abspath(__file__))
+worker_class = 'gthread'
+workers = int(os.environ.get('API_WORKERS', 2))
+threads = int(os.environ.get('API_THREADS', 4))
+keepalive = int(os.environ.get('API_KEEPALIVE', 5)) # seconds an idle client connection stays open
+# the first request of a worker, or the first one after a reload, loads the snapshot
+timeout = int(os.environ.get('API_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('API_GRACEFUL_TIMEOUT', 30))
+accesslog = '-'
+errorlog = '-'
+
+
+####################
+### SERVER HOOKS ###
+####################
+def worker_exit(server, worker):
+    """Closes the redis connections of a worker process as it exits (see connections.close_pools())."""
+    from connections import close_pools
+    close_pools()
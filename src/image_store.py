@@ -0,0 +1,171 @@
+import json
+import os
+import uuid
+import requests
+from plots import IMAGE_FORMATS
+from typing import BinaryIO, Tuple
+# image_store.py
+# Where the images of the plot jobs are kept. The store a job used is
+# recorded in its results, so images stay readable and deletable after
+# IMAGE_STORE changes:
+#   - 'redis': image bytes in redis db 5, served by GET /jobs/jids/<jid>/image
+#   - 'local': image files in IMAGE_DIR (a volume shared by the API and the
+#       worker), served by the same route
+#   - 'imgur': uploaded to the Imgur API, the route redirects to the Imgur link
+
+########################
+### GLOBAL VARIABLES ###
+########################
+IMAGE_STORES = ('redis', 'local', 'imgur')
+IMAGE_STORE = os.environ.get('IMAGE_STORE', 'redis')
+IMAGE_DIR = os.environ.get('IMAGE_DIR', 'images')
+IMAGE_KEY = 'image:{}'
+access_token = os.environ.get("IMAGUR_ACCESS_TOKEN", "967ffa0d6f32d43b44578bac270e080f506ae998")
+imagur_auth = f'Bearer {access_token}'
+imagur_image_endpoint = "https://api.imgur.com/3/image"
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def save_image(client, image:BinaryIO, image_format:str="png", store:str=IMAGE_STORE) -> dict:
+    """
+    Description
+    -----------
+        - Stores a rendered image
+    Args
+    -----------
+        - client: redis client of the image database (used by the 'redis' store)
+        - image: buffer holding the image (see worker.render_image())
+        - image_format: one of IMAGE_FORMATS (string)
+        - store: one of IMAGE_STORES (string)
+    Returns
+    -----------
+        - Results of the job, a dictionary containing the following:
+            - store(str): *store holding the image*
+            - id(str): *id of the image in that store*
+            - format(str): *format of the image*
+            - datetime(int), link(str), deletehash(str): *imgur store only*
+        - None if the image could not be uploaded to imgur
+    """
+    if store == 'imgur':
+        return _upload_to_imgur(image, image_format)
+    image_id = uuid.uuid4().hex
+    if store == 'redis':
+        client.set(IMAGE_KEY.format(image_id), image.getvalue())
+    elif store == 'local':
+        os.makedirs(IMAGE_DIR, exist_ok=True)
+        with open(_image_path(image_id, image_format), 'wb') as f:
+            f.write(image.getvalue())
+    else:
+        raise ValueError(f"unknown image store '{store}', expected one of {', '.join(IMAGE_STORES)}")
+    return {'store': store, 'id': image_id, 'format': image_format}
+
+
+def load_image(client, results:dict) -> Tuple[bytes, str]:
+    """
+    Description
+    -----------
+        - Reads back an image stored by save_image() in the 'redis' or 'local' store
+    Args
+    -----------
+        - client: redis client of the image database
+        - results: results of the job (dict)
+    Returns
+    -----------
+        - Tuple of the image (bytes, None if it no longer exists) and its content type (string)
+    """
+    image_format = results.get('format', 'png')
+    content_type = IMAGE_FORMATS[image_format]['content_type']
+    if results.get('store') == 'redis':
+        return client.get(IMAGE_KEY.format(results['id'])), content_type
+    if results.get('store') == 'local':
+        try:
+            with open(_image_path(results['id'], image_format), 'rb') as f:
+                return f.read(), content_type
+        except FileNotFoundError:
+            return None, content_type
+    raise ValueError(f"images of the '{results.get('store')}' store are not served locally")
+
+
+def delete_stored_image(client, results:dict) -> bool:
+    """
+    Description
+    -----------
+        - Deletes the image of a job from its store. Results without a 'store'
+            come from before the stores were added and point to imgur.
+    Args
+    -----------
+        - client: redis client of the image database
+        - results: results of the job (dict)
+    Returns
+    -----------
+        - Boolean True is deletion was successful else False
+    """
+    store = results.get('store', 'imgur')
+    if store == 'redis':
+        return client.delete(IMAGE_KEY.format(results['id'])) == 1
+    if store == 'local':
+        try:
+            os.remove(_image_path(results['id'], results.get('format', 'png')))
+            return True
+        except FileNotFoundError:
+            return False
+    deletehash = results.get('deletehash')
+    if deletehash is None:
+        print(f"No delete hash attribute found in results: {results}")
+        return False
+    header = {"Authorization": imagur_auth}
+    try:
+        requests.delete(f"{imagur_image_endpoint}/{deletehash}", headers=header)
+    except Exception as e:
+        print(f"ERROR deleting image from imagur: {e}")
+        return False
+    return True
+
+
+def _image_path(image_id:str, image_format:str) -> str:
+    """Path of an image of the 'local' store."""
+    return os.path.join(IMAGE_DIR, f"{image_id}.{IMAGE_FORMATS[image_format]['extension']}")
+
+
+def _upload_to_imgur(image:BinaryIO, image_format:str="png") -> dict:
+    """
+    Description
+    -----------
+        - Helper function to easily upload host images using the Imagur API.
+            The buffer is streamed as a multipart file.
+    Args
+    -----------
+        - image: buffer holding the image to upload (see worker.render_image())
+        - image_format: one of IMAGE_FORMATS (string). NOTE: imagur does not accept svg images
+
+    Returns
+    -----------
+        - Dictionary object containing the following:
+            - deletehash(str): *key used to later delete the image*.
+            - link(str): *public link to image*
+            - datetime(int): *denotes time (Epoch in seconds) of image upload.
+            - format(str): *format of the image*
+    """
+    options = IMAGE_FORMATS[image_format]
+    files = {'image': (f"plot.{options['extension']}", image, options['content_type'])}
+    header = {'Authorization': imagur_auth}
+    # try to make post request to imagur, else print errors
+    try:
+        response = requests.post(imagur_image_endpoint, headers=header, files=files)
+    except Exception as e:
+        print(f'EXCEPTION CAUGHT...while trying to upload image onto imagur: {e}')
+        return
+    if response.status_code == 200:
+        content = json.loads(response.content.decode('utf-8'))
+        return {
+                'store': 'imgur',
+                'id': content['data']['id'],
+                'link': content['data']['link'],
+                'deletehash': content['data']['deletehash'],
+                'datetime': content['data']['datetime'],
+                'format': image_format
+                }
+    else:
+        print(f'An error has occured uploading image to imagur. check header: {header}')
+        return
@@ -0,0 +1,379 @@
+import codecs
+import json
+import os
+import time
+import requests
+from dataset import WATERMARK_FIELDS, to_number, get_indexed_values, index_incident, get_watermark, set_watermark, \
+        bump_dataset_version, publish_dataset, INGEST_LOCK_KEY, INGEST_LOCK_TIMEOUT
+from cube import CUBE_READY_KEY
+from connections import INCIDENTS_DB, STAGING_DB
+from storage import assign_codes, store_incident, STORAGE_FORMAT
+from typing import Iterable, Iterator, List, Tuple, Union
+# ingest.py
+# Helpers used to clean rows from the Austin traffic incidents feed and
+# write them into the redis database (db 0) in batches.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+SOURCE_URL = 'https://data.austintexas.gov/api/views/dx9v-zd7x/rows.json?accessType=DOWNLOAD'
+AUSTIN_LAT = 30.2672
+AUSTIN_LON = -97.7431
+LAT_TOL = 5
+LON_TOL = 5
+INGEST_MODES = ('full', 'delta') # 'mode' parameter of the incidents jobs
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+INGEST_STREAM = os.environ.get('INGEST_STREAM', 'true').lower() in ('1', 'true', 'yes')
+INGEST_CHUNK_SIZE = int(os.environ.get('INGEST_CHUNK_SIZE', 64 * 1024))
+_WHITESPACE = ' \t\n\r'
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def get_columns(meta:dict) -> Tuple[List[str], List[list]]:
+    """
+    Description:
+    -----------
+        - Reads the column names and flags out of the 'meta' section of the
+            rows.json download
+
+    Args:
+    -----------
+        - meta: the 'meta' object of the rows.json payload (dict)
+
+    Returns:
+    -----------
+        - Tuple of two lists: the column names (with ':' removed) and the
+            flags of each column (None if the column has no flags)
+    """
+    cols = []
+    flags = []
+    for col_json in meta['view']['columns']:
+        cols.append(col_json['fieldName'].replace(':', ''))
+        flags.append(col_json.get('flags'))
+    return cols, flags
+
+
+def iter_source_chunks(source:str, chunk_size:int=INGEST_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Description:
+    -----------
+        - Reads the rows.json download incrementally, either from an http(s)
+            url or from a local file (plain path or file:// url)
+
+    Args:
+    -----------
+        - source: url or path of the rows.json payload (string)
+        - chunk_size: number of bytes read at a time (int)
+
+    Returns:
+    -----------
+        - Iterator of byte chunks
+    """
+    if source.startswith(('http://', 'https://')):
+        with requests.get(url = source, stream = True) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size = chunk_size)
+    else:
+        if source.startswith('file://'):
+            source = source[len('file://'):]
+        with open(source, 'rb') as f:
+            yield from iter(lambda: f.read(chunk_size), b'')
+
+
+def stream_rows_json(chunks:Iterable[Union[bytes, str]]) -> Iterator:
+    """
+    Description:
+    -----------
+        - Incremental parser for the rows.json payload ({"meta": {...}, "data": [[...], ...]}).
+            Only the chunk being parsed and the current row are held in memory, so
+            memory use does not grow with the size of the dataset.
+
+    Args:
+    -----------
+        - chunks: iterable of bytes (utf-8) or str pieces of the payload
+
+    Returns:
+    -----------
+        - Iterator that first yields the 'meta' object (dict) and then every
+            row of 'data' (list), one at a time.
+            Raises ValueError if the payload is malformed or if 'data' comes before 'meta'
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    eof = False
+
+    def read_more() -> bool:
+        nonlocal buf, pos, eof
+        if eof:
+            return False
+        try:
+            chunk = next(chunks)
+        except StopIteration:
+            eof = True
+            buf = buf[pos:] + utf8.decode(b'', final = True)
+            pos = 0
+            return False
+        if isinstance(chunk, bytes):
+            chunk = utf8.decode(chunk)
+        buf = buf[pos:] + chunk
+        pos = 0
+        return True
+
+    def next_char() -> str:
+        # skips whitespace and returns the next significant character ('' at the end of the payload)
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if not read_more():
+                return ''
+
+    def expect(char:str) -> None:
+        nonlocal pos
+        if next_char() != char:
+            raise ValueError(f"malformed rows.json payload: expected '{char}' at offset {pos}")
+        pos += 1
+
+    def next_value():
+        # decodes one complete JSON value, reading more chunks while it is cut off
+        nonlocal pos
+        next_char()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+                # a number at the very end of the buffer may continue in the next chunk
+                if end < len(buf) or eof:
+                    pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise ValueError(f"malformed rows.json payload: {e}")
+            read_more()
+
+    seen_meta = False
+    expect('{')
+    while next_char() != '}':
+        key = next_value()
+        expect(':')
+        if key == 'data':
+            if not seen_meta:
+                raise ValueError("malformed rows.json payload: 'data' appears before 'meta'")
+            expect('[')
+            while next_char() != ']':
+                yield next_value()
+                if next_char() == ',':
+                    pos += 1
+            pos += 1
+        elif key == 'meta':
+            seen_meta = True
+            yield next_value()
+        else:
+            next_value()
+        if next_char() == ',':
+            pos += 1
+        elif next_char() == '':
+            raise ValueError("malformed rows.json payload: unexpected end of data")
+
+
+def _is_far_from_austin(value, center:float, tol:float) -> bool:
+    """Returns True if the coordinate `value` is a number outside of `center` +/- `tol`."""
+    try:
+        return abs(float(value) - center) > tol
+    except (TypeError, ValueError):
+        return False
+
+
+def clean_incident(datum:list, cols:List[str], flags:List[list]) -> dict:
+    """
+    Description:
+    -----------
+        - Converts a single row of the rows.json 'data' list into the
+            incident mapping that is stored in redis. Empty values become '',
+            coordinates too far away from Austin are blanked out and hidden
+            columns are dropped.
+
+    Args:
+    -----------
+        - datum: row of values, in the same order as `cols` (list)
+        - cols: column names returned by get_columns()
+        - flags: column flags returned by get_columns()
+
+    Returns:
+    -----------
+        - Dictionary pairing each visible column with its cleaned value
+    """
+    incident = {}
+    for ii in range(0, len(cols)):
+        # Restrict columns to non-hidden ones
+        if flags[ii] is None or 'hidden' not in flags[ii]:
+            incident[cols[ii]] = '' if datum[ii] is None else datum[ii]
+    # Data cleaning: a point outside of the tolerance box loses both coordinates
+    if _is_far_from_austin(incident.get('latitude'), AUSTIN_LAT, LAT_TOL) \
+            or _is_far_from_austin(incident.get('longitude'), AUSTIN_LON, LON_TOL):
+        if 'latitude' in incident:
+            incident['latitude'] = ''
+        if 'longitude' in incident:
+            incident['longitude'] = ''
+    return incident
+
+
+def changed_since(incidents:Iterable[dict], watermark:dict, newest:dict) -> Iterator[dict]:
+    """
+    Description:
+    -----------
+        - Delta filter used by incremental refreshes: only lets through the
+            incidents that were published or had their status updated after
+            the given watermark. While iterating, `newest` is updated in place
+            with the largest value seen for each watermark field, which
+            becomes the watermark of the next refresh.
+
+    Args:
+    -----------
+        - incidents: iterable of incident dictionaries (see clean_incident())
+        - watermark: dictionary returned by dataset.get_watermark(). An empty
+            watermark lets every incident through (full refresh)
+        - newest: dictionary filled with the new watermark
+
+    Returns:
+    -----------
+        - Iterator of the new or changed incidents
+    """
+    for incident in incidents:
+        changed = not watermark
+        for field in WATERMARK_FIELDS:
+            value = to_number(incident.get(field))
+            if value is None:
+                continue
+            if value > newest.get(field, float('-inf')):
+                newest[field] = value
+            if value > watermark.get(field, float('-inf')):
+                changed = True
+        if changed:
+            yield incident
+
+
+def write_incidents(client, incidents:Iterable[dict], batch_size:int=INGEST_BATCH_SIZE,
+                    transaction:bool=True, storage_format:str=STORAGE_FORMAT) -> int:
+    """
+    Description:
+    -----------
+        - Writes incidents into redis, one record per incident keyed on its
+            traffic_report_id (see storage.py), and keeps the secondary indexes
+            (see dataset.py) up to date. Incidents are grouped into batches of
+            `batch_size` and each batch costs two round-trips (read the old
+            indexed values, then write everything in a single pipeline), plus
+            one to look up the dictionary codes in the 'packed' format. When
+            an incident appears several times in a batch, its last row wins.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - incidents: iterable of incident dictionaries (see clean_incident())
+        - batch_size: number of incidents written per pipeline (int)
+        - transaction: wrap every batch in MULTI/EXEC (bool)
+        - storage_format: one of storage.STORAGE_FORMATS
+
+    Returns:
+    -----------
+        - Number of incidents written (int), rows repeated within a batch count once
+    """
+    if batch_size < 1:
+        raise ValueError(f"batch_size must be a positive integer, got {batch_size}")
+    total = 0
+    batch = {} # traffic_report_id -> incident, a later row of the same incident replaces the earlier one
+    start_time = time.time()
+
+    def flush():
+        # one row per incident: the previous values read below are those of
+        # every row of the batch, a duplicate would be indexed twice
+        rows = list(batch.values())
+        previous = get_indexed_values(client, list(batch), storage_format)
+        codes = assign_codes(client, rows) if storage_format == 'packed' else None
+        pipe = client.pipeline(transaction=transaction)
+        for incident, old_values in zip(rows, previous):
+            store_incident(pipe, incident, codes, storage_format)
+            index_incident(pipe, incident, old_values)
+        pipe.execute()
+        print(f'{total} entries posted ({time.time() - start_time:.2f}s elapsed)')
+        batch.clear()
+
+    for incident in incidents:
+        if not incident or not incident.get('traffic_report_id'):
+            continue
+        if incident['traffic_report_id'] not in batch:
+            total += 1
+        batch[incident['traffic_report_id']] = incident
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    return total
+
+
+def load_incidents(client, staging, locks, batch_size:int=INGEST_BATCH_SIZE, stream:bool=INGEST_STREAM,
+                   source:str=SOURCE_URL, delta:bool=False) -> int:
+    """
+    Description:
+    -----------
+        - Saves the Austin traffic incidents dataset into redis. Incidents are
+            written in pipelined batches (see write_incidents()). A full
+            refresh is loaded into the staging database and swapped in once
+            complete, a delta is written in a single transaction: readers never
+            see a partial ingest. Ingests run one at a time (INGEST_LOCK_KEY).
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - staging: redis client of the staging database (see dataset.publish_dataset())
+        - locks: redis client of the database holding INGEST_LOCK_KEY
+        - batch_size: number of incidents written per redis round-trip (int)
+        - stream: parse the download incrementally instead of loading the
+            whole payload in memory first (bool)
+        - source: url or local path of the rows.json payload (string)
+        - delta: only upsert incidents published or updated since the last
+            refresh (see changed_since())
+
+    Returns:
+    -----------
+        - Number of incidents posted (int)
+    """
+    with locks.lock(INGEST_LOCK_KEY, timeout=INGEST_LOCK_TIMEOUT):
+        if stream:
+            rows = stream_rows_json(iter_source_chunks(source))
+            meta = next(rows)
+        else:
+            the_json = json.loads(b''.join(iter_source_chunks(source)))
+            meta, rows = the_json['meta'], the_json['data']
+        cols, flags = get_columns(meta)
+        watermark = get_watermark(client) if delta else {}
+        newest = {}
+        incidents = changed_since((clean_incident(datum, cols, flags) for datum in rows),
+                                  watermark, newest)
+        if watermark:
+            # a delta is small, all of it goes in one MULTI/EXEC
+            incidents = list(incidents)
+            count = write_incidents(client, incidents, max(len(incidents), 1))
+            # the watermark only moves once the incidents are committed, along
+            # with the version: if this fails, the next delta writes them again
+            pipe = client.pipeline()
+            set_watermark(pipe, newest)
+            if count:
+                bump_dataset_version(pipe)
+            pipe.execute()
+            return count
+        staging.flushdb(asynchronous=True) # leftovers of an interrupted refresh
+        # nobody reads the staging database, batches do not need MULTI/EXEC
+        count = write_incidents(staging, incidents, batch_size, transaction=False)
+        if not count:
+            return count # keep the live dataset rather than swapping in an empty one
+        set_watermark(staging, newest)
+        staging.set(CUBE_READY_KEY, 1) # the count cube was filled along with the empty database
+        bump_dataset_version(staging)
+        publish_dataset(staging, STAGING_DB, INCIDENTS_DB)
+        return count
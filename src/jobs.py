@@ -1,18 +1,18 @@
 import uuid
 from hotqueue import HotQueue
-import redis
-import os
 import json
+from connections import get_client, get_pool, INCIDENTS_DB, QUEUE_DB, JOBS_DB, RESULTS_DB, IMAGES_DB, STAGING_DB
 # jobs.py
 # JUST TO CLARIFY
-# REDIS DB'S
-# 0: traffic data
-# 1: job queue (ids only)
-# 2: job details and results (job id, status, parameters)
-redis_host = os.environ.get('REDIS_HOSTNAME', '127.0.0.1')
-queue = HotQueue('queue', host=redis_host, port=6379, db=1)
-rd = redis.Redis(host=redis_host, port=6379, db=0, decode_responses=True)
-rd_details = redis.Redis(host = redis_host, port = 6379, db = 2, decode_responses = False)
+# REDIS DB'S: see connections.py
+# the queue waits on BLPOP, its connections have no socket timeout
+queue = HotQueue('queue', connection_pool=get_pool(QUEUE_DB, decode_responses=False, blocking_commands=True))
+rd = get_client(INCIDENTS_DB)
+rd_staging = get_client(STAGING_DB)
+rd_locks = get_client(QUEUE_DB) # holds dataset.INGEST_LOCK_KEY
+rd_details = get_client(JOBS_DB, decode_responses=False)
+rd_results = get_client(RESULTS_DB)
+rd_images = get_client(IMAGES_DB, decode_responses=False)
 
 def _generate_jid():
     """
@@ -20,18 +20,22 @@ def _generate_jid():
     """
     return str(uuid.uuid4())
 
-def _instantiate_job(jid, job_type, status, start, end):
+def _instantiate_job(jid, job_type, status, start, end, params=None):
     """
     Create the job object description as a python dictionary. Requires the job id, status,
-    start and end parameters.
+    start and end parameters. Optional job specific parameters (e.g. the ingest mode)
+    are stored under 'params'.
     """
     if type(jid) == str:
-        return {'id': jid,
+        job = {'id': jid,
                 'status': status,
                 'job_type': job_type,
                 'start': start,
                 'end': end
         }
+        if params:
+            job['params'] = params
+        return job
     return {'id': jid.decode('utf-8'),
             'status': status.decode('utf-8'),
             'job_type': job_type.decode("utf-8"),
@@ -48,10 +52,10 @@ def _queue_job(jid):
     """Add a job to the redis queue."""
     queue.put(jid)
 
-def add_job(start, end, job_type, status="submitted"):
+def add_job(start, end, job_type, status="submitted", params=None):
     """Add a job to the redis queue."""
     jid = _generate_jid()
-    job_dict = _instantiate_job(jid, job_type, status, start, end)
+    job_dict = _instantiate_job(jid, job_type, status, start, end, params)
     print(f"now saving job to redis: {job_dict}")
     _save_job(job_dict['id'], json.dumps(job_dict))
     _queue_job(job_dict['id'])
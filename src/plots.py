@@ -0,0 +1,238 @@
+import datetime
+import os
+import numpy as np
+from cube import grid_cells, incident_day, day_start, add_slice, GRID_SHAPE, CUBE_DAY_KEY, \
+        CUBE_DAYS_KEY, CUBE_READY_KEY
+from dataset import get_dataset_version, to_number, PUBLISHED_KEY, INGEST_LOCK_KEY, INGEST_LOCK_TIMEOUT
+from snapshot import get_snapshot, load_snapshot
+from storage import read_incidents
+# plots.py
+# Data loading shared by the plot jobs of worker.py. Every plot type reads
+# the same columnar snapshot (see snapshot.py) instead of scanning redis
+# key by key, except for the heatmap which sums daily slices of the count
+# cube (see cube.py).
+
+########################
+### GLOBAL VARIABLES ###
+########################
+# keep the snapshot in the worker between jobs, it is reloaded when the dataset version changes
+PLOT_CACHE = os.environ.get('PLOT_CACHE', 'true').lower() in ('1', 'true', 'yes')
+# time bins of the timeseries plot (job parameter 'granularity')
+TIME_GRANULARITIES = ('year', 'month', 'week', 'day', 'hour', 'weekday')
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+SECONDS_PER_DAY = 86400
+# output formats of the plot jobs (job parameter 'format'), with their savefig() options
+IMAGE_FORMATS = {
+    'png': {'format': 'png', 'extension': 'png', 'content_type': 'image/png'},
+    'png-compressed': {'format': 'png', 'extension': 'png', 'content_type': 'image/png'},
+    'webp': {'format': 'webp', 'extension': 'webp', 'content_type': 'image/webp',
+             'savefig': {'pil_kwargs': {'quality': 80}}},
+    'svg': {'format': 'svg', 'extension': 'svg', 'content_type': 'image/svg+xml'},
+}
+# bounds of the job parameter 'dpi'
+MIN_DPI = 10
+MAX_DPI = 600
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def load_plot_data(client, start:float=None, end:float=None, use_cache:bool=PLOT_CACHE) -> dict:
+    """
+    Description:
+    -----------
+        - Loads the columns needed by the plot jobs for every incident
+            published between `start` and `end`. The whole dataset is read with
+            SSCAN + pipelined reads (see snapshot.load_snapshot) and the time
+            window is applied as a vectorized mask.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - start, end: published_date bounds in seconds, inclusive (None for no bound)
+        - use_cache: reuse the snapshot of the previous job if the dataset did not change
+
+    Returns:
+    -----------
+        - Dictionary with the following NumPy arrays:
+            - published: published_date of every incident in the window
+            - lat, lon: coordinates of the incidents in the window that have valid coordinates
+    """
+    if use_cache:
+        snapshot = get_snapshot(client)
+    else:
+        snapshot = load_snapshot(client, get_dataset_version(client))
+    published = snapshot['published']
+    mask = np.ones(len(published), dtype=bool)
+    if start is not None:
+        mask &= published >= start
+    if end is not None:
+        mask &= published <= end
+    located = mask & np.isfinite(snapshot['lat']) & np.isfinite(snapshot['lon'])
+    return {'published': published[mask],
+            'lat': snapshot['lat'][located],
+            'lon': snapshot['lon'][located]}
+
+
+def local_seconds(published:np.ndarray) -> np.ndarray:
+    """
+    Description:
+    -----------
+        - Shifts epoch seconds by the UTC offset of the local timezone, like
+            datetime.datetime.fromtimestamp() does, so that calendar bins can be
+            computed with integer arithmetic. The offset is looked up once per
+            distinct hour instead of once per incident.
+
+    Args:
+    -----------
+        - published: epoch seconds (NumPy array)
+
+    Returns:
+    -----------
+        - int64 array of local "wall clock" seconds since 1970-01-01 00:00
+    """
+    seconds = published.astype(np.int64)
+    if not len(seconds):
+        return seconds
+    hours, inverse = np.unique(seconds // 3600, return_inverse=True)
+    offsets = np.array([datetime.datetime.fromtimestamp(int(hour) * 3600).astimezone().utcoffset().total_seconds()
+                        for hour in hours], dtype=np.int64)
+    return seconds + offsets[inverse]
+
+
+def time_histogram(published:np.ndarray, granularity:str='year') -> tuple:
+    """
+    Description:
+    -----------
+        - Counts incidents per time bin with np.bincount. Calendar bins (year,
+            month, week starting on Monday, day) cover every bin from the first
+            to the last incident, empty ones included. 'hour' (hour of the day)
+            and 'weekday' (day of the week) always return 24 and 7 bins.
+
+    Args:
+    -----------
+        - published: epoch seconds (NumPy array)
+        - granularity: one of TIME_GRANULARITIES (string)
+
+    Returns:
+    -----------
+        - Tuple of the bin labels (list of strings) and their counts (int array).
+            Raises ValueError for an unknown granularity
+    """
+    if granularity not in TIME_GRANULARITIES:
+        raise ValueError(f"unknown granularity '{granularity}', expected one of {', '.join(TIME_GRANULARITIES)}")
+    seconds = local_seconds(published)
+    days = seconds // SECONDS_PER_DAY
+    if granularity == 'hour':
+        return [f'{hour:02d}' for hour in range(24)], np.bincount((seconds // 3600) % 24, minlength=24)
+    if granularity == 'weekday':
+        # 1970-01-01 was a Thursday
+        return list(WEEKDAYS), np.bincount((days + 3) % 7, minlength=7)
+    if not len(days):
+        return [], np.zeros(0, dtype=np.int64)
+    if granularity == 'week':
+        bins = (days + 3) // 7 # weeks starting on Monday, labelled by their first day
+        first = bins.min()
+        starts = (np.arange(first, bins.max() + 1) * 7 - 3).astype('datetime64[D]')
+        labels = np.datetime_as_string(starts, unit='D')
+    else:
+        unit = {'year': 'Y', 'month': 'M', 'day': 'D'}[granularity]
+        bins = days.astype('datetime64[D]').astype(f'datetime64[{unit}]').astype(np.int64)
+        first = bins.min()
+        labels = np.datetime_as_string(np.arange(first, bins.max() + 1).astype(f'datetime64[{unit}]'), unit=unit)
+    return labels.tolist(), np.bincount(bins - first)
+
+
+def build_cube(client, locks, blocking_timeout:float=None) -> None:
+    """
+    Description:
+    -----------
+        - Recomputes the whole count cube from the incidents, for data written
+            before the cube existed. Ingests keep it up to date afterwards.
+            Runs under INGEST_LOCK_KEY: an ingest adding incidents between the
+            snapshot and the rebuild would otherwise be missing from the cube.
+            Raises redis.exceptions.LockError if an ingest still runs after
+            `blocking_timeout` seconds.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - locks: redis client of the database holding INGEST_LOCK_KEY
+        - blocking_timeout: seconds waited for a running ingest (None waits until it is done)
+    """
+    with locks.lock(INGEST_LOCK_KEY, timeout=INGEST_LOCK_TIMEOUT, blocking_timeout=blocking_timeout):
+        snapshot = load_snapshot(client, get_dataset_version(client))
+        cells = grid_cells(snapshot['lat'], snapshot['lon'])
+        days = local_seconds(snapshot['published'][cells >= 0]) // SECONDS_PER_DAY
+        entries, counts = np.unique(days * (GRID_SHAPE[0] * GRID_SHAPE[1]) + cells[cells >= 0], return_counts=True)
+        slices = {}
+        for entry, count in zip(entries.tolist(), counts.tolist()):
+            day, cell = divmod(entry, GRID_SHAPE[0] * GRID_SHAPE[1])
+            slices.setdefault(day, {})[cell] = count
+        old_days = client.zrange(CUBE_DAYS_KEY, 0, -1)
+        pipe = client.pipeline() # MULTI/EXEC, readers never see a half built cube
+        for day in old_days:
+            pipe.delete(CUBE_DAY_KEY.format(day))
+        pipe.delete(CUBE_DAYS_KEY)
+        for day, day_cells in slices.items():
+            pipe.hset(CUBE_DAY_KEY.format(day), mapping=day_cells)
+            pipe.zadd(CUBE_DAYS_KEY, {day: day})
+        pipe.set(CUBE_READY_KEY, 1)
+        pipe.execute()
+    print(f"built the count cube: {len(slices)} days, {int(counts.sum())} incidents")
+
+
+def _count_published_between(client, counts:np.ndarray, low:str, high:str) -> None:
+    """Adds the incidents published between `low` and `high` (ZRANGEBYSCORE bounds) to flat grid counts."""
+    keys = client.zrangebyscore(PUBLISHED_KEY, low, high)
+    if not keys:
+        return
+    coordinates = read_incidents(client, keys, ('latitude', 'longitude'))
+    lat = np.array([to_number(incident['latitude']) for incident in coordinates], dtype=np.float64)
+    lon = np.array([to_number(incident['longitude']) for incident in coordinates], dtype=np.float64)
+    cells = grid_cells(lat, lon)
+    counts += np.bincount(cells[cells >= 0], minlength=len(counts))
+
+
+def load_grid_counts(client, locks, start:float=None, end:float=None, blocking_timeout:float=None) -> np.ndarray:
+    """
+    Description:
+    -----------
+        - Heatmap counts of the incidents published between `start` and `end`.
+            The days fully inside the window are summed from the count cube,
+            the incidents of the partial days at both ends are read from the
+            published_date index.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - locks: redis client of the database holding INGEST_LOCK_KEY (see build_cube())
+        - start, end: published_date bounds in seconds, inclusive (None for no bound)
+        - blocking_timeout: seconds waited for a running ingest when the cube
+            must be built first, see build_cube() (None waits until it is done)
+
+    Returns:
+    -----------
+        - int64 array of shape GRID_SHAPE, indexed [longitude bin, latitude bin]
+            like np.histogram2d over cube.GRID_BBOX
+    """
+    if not client.exists(CUBE_READY_KEY):
+        build_cube(client, locks, blocking_timeout)
+    counts = np.zeros(GRID_SHAPE[0] * GRID_SHAPE[1], dtype=np.int64)
+    first = None if start is None else incident_day(start)
+    if first is not None and day_start(first) != start:
+        first += 1 # the first day is partial
+    last = None if end is None else incident_day(end) - 1 # the day of `end` is partial
+    if first is not None and last is not None and first > last:
+        _count_published_between(client, counts, start, end)
+        return counts.reshape(GRID_SHAPE)
+    days = client.zrangebyscore(CUBE_DAYS_KEY, '-inf' if first is None else first, '+inf' if last is None else last)
+    pipe = client.pipeline(transaction=False)
+    for day in days:
+        pipe.hgetall(CUBE_DAY_KEY.format(day))
+    for cells in pipe.execute():
+        add_slice(counts, cells)
+    if start is not None:
+        _count_published_between(client, counts, start, f'({day_start(first)}')
+    if end is not None:
+        _count_published_between(client, counts, day_start(last + 1), end)
+    return counts.reshape(GRID_SHAPE)
@@ -0,0 +1,141 @@
+import base64
+import json
+import geopy.distance
+from dataset import iter_query_ids, to_number
+from scan import batched, FETCH_BATCH_SIZE
+from storage import read_incidents
+from typing import Callable, List, Tuple
+# query.py
+# Query engine behind the GET /incidents family of routes. Candidates come
+# from the secondary indexes (see dataset.py), are fetched in pipelined
+# batches and checked once against a predicate compiled per request.
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def compile_filter(incident_type:str='all', status:str='all', start:float=float('-inf'),
+                   end:float=float('inf'), radius:float=float('inf'), lng:float=None,
+                   lat:float=None) -> Callable[[dict], bool]:
+    """
+    Description:
+    -----------
+        - Builds a single predicate checking every query parameter on an
+            incident. Lower casing, date parsing and the selection of the
+            checks that are actually needed happen once, here, instead of once
+            per incident.
+
+    Args:
+    -----------
+        - incident_type, status: values to match, case insensitive ('all' matches everything)
+        - start, end: published_date bounds in seconds (inclusive)
+        - radius: distance in miles (geodesic) around (lng, lat)
+
+    Returns:
+    -----------
+        - Function taking an incident (dict) and returning True if it matches
+    """
+    checks = []
+    if incident_type.lower() != 'all':
+        incident_type = incident_type.lower()
+        checks.append(lambda incident: incident.get('issue_reported', '').lower() == incident_type)
+    if status.lower() != 'all':
+        status = status.lower()
+        checks.append(lambda incident: incident.get('traffic_report_status', '').lower() == status)
+    if start != float('-inf') or end != float('inf'):
+        def in_time_range(incident):
+            published = to_number(incident.get('published_date'))
+            return published is not None and start <= published <= end
+        checks.append(in_time_range)
+    if radius != float('inf'):
+        center = (lat, lng)
+        def in_radius(incident):
+            lat_value = to_number(incident.get('latitude'))
+            lon_value = to_number(incident.get('longitude'))
+            if lat_value is None or lon_value is None:
+                return False
+            return geopy.distance.geodesic(center, (lat_value, lon_value)).miles <= radius
+        checks.append(in_radius)
+    if not checks:
+        return lambda incident: True
+    if len(checks) == 1:
+        return checks[0]
+    return lambda incident: all(check(incident) for check in checks)
+
+
+def encode_cursor(position:Tuple[float, str]) -> str:
+    """Turns a (published_date, id) position into an opaque url safe token."""
+    return base64.urlsafe_b64encode(json.dumps(list(position)).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor:str) -> Tuple[float, str]:
+    """
+    Description:
+    -----------
+        - Reads back a token made by encode_cursor()
+
+    Args:
+    -----------
+        - cursor: token returned with the previous page (string)
+
+    Returns:
+    -----------
+        - (published_date, id) tuple. Raises ValueError if the token is invalid
+    """
+    try:
+        score, key = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return float(score), str(key)
+    except Exception as e:
+        raise ValueError(f"invalid cursor '{cursor}'") from e
+
+
+def filter_incidents(client, incident_type:str='all', status:str='all', start:float=float('-inf'),
+                     end:float=float('inf'), radius:float=float('inf'), lng:float=None,
+                     lat:float=None, offset:int=0, limit:int=None,
+                     cursor:str=None) -> Tuple[List[dict], str]:
+    """
+    Description:
+    -----------
+        - Returns one page of the incidents matching the query parameters (see
+            compile_filter()). Matches are counted after filtering, so a page only
+            comes back short when there are no more matches. Candidates are read
+            and fetched FETCH_BATCH_SIZE at a time and reading stops as soon as
+            the page is full.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - offset: number of matches to skip (int)
+        - limit: maximum number of matches to return (int, None for no limit)
+        - cursor: token returned with the previous page, the page starts right after it
+        - every other argument is described in compile_filter()
+
+    Returns:
+    -----------
+        - Tuple of the matching incidents (list of dicts, ordered by published_date)
+            and the cursor of the next page (None once the last page was returned)
+    """
+    if limit is not None and limit <= 0:
+        return [], None
+    after = decode_cursor(cursor) if cursor else None
+    candidates = iter_query_ids(client, incident_type, status, start, end, radius, lng, lat,
+                                after=after, chunk_size=FETCH_BATCH_SIZE)
+    # the indexes already matched type, status and time range, only the exact
+    # geodesic distance of the geo index candidates is left to check
+    is_match = compile_filter(radius=radius, lng=lng, lat=lat)
+    results = []
+    skipped = 0
+    try:
+        for batch in batched(candidates, FETCH_BATCH_SIZE):
+            incidents = read_incidents(client, [key for key, _ in batch])
+            for (key, score), incident in zip(batch, incidents):
+                if not incident or not is_match(incident):
+                    continue
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                results.append(incident)
+                if limit is not None and len(results) >= limit:
+                    return results, encode_cursor((score, key))
+        return results, None
+    finally:
+        candidates.close()
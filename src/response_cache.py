@@ -0,0 +1,128 @@
+import collections
+import hashlib
+import json
+import os
+import threading
+# response_cache.py
+# Cache of the GET /incidents family of responses. Entries are addressed by
+# a hash of the route, the normalized query parameters (see
+# atx_traffic.get_query_params) and the dataset version, which changes on
+# every ingest and DELETE /incidents, so entries never need to be
+# invalidated: they simply stop being requested. The hash doubles as the
+# ETag of the response. Each API process keeps the most recently used
+# responses in memory and can share them through redis. Both tiers are
+# bounded by the size of the serialized responses: responses larger than
+# RESPONSE_CACHE_MAX_ENTRY_BYTES (e.g. the whole dataset without a limit)
+# are not cached at all, and the memory tier holds at most
+# RESPONSE_CACHE_BYTES of responses.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 256))
+RESPONSE_CACHE_BYTES = int(os.environ.get('RESPONSE_CACHE_BYTES', 64 * 2**20)) # memory tier, per process
+RESPONSE_CACHE_MAX_ENTRY_BYTES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRY_BYTES', 4 * 2**20))
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300)) # redis tier only
+RESPONSE_KEY = 'response:{}'
+_responses = collections.OrderedDict() # key -> ((body, headers), serialized size)
+_responses_bytes = 0
+_responses_lock = threading.Lock()
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def response_key(route:str, params:dict, version:str) -> str:
+    """
+    Description:
+    -----------
+        - Hashes everything a response depends on
+
+    Args:
+    -----------
+        - route: name of the endpoint (string)
+        - params: normalized query parameters (dict of JSON serializable values)
+        - version: dataset version (string)
+
+    Returns:
+    -----------
+        - Hex digest identifying the response, also used as its ETag (string)
+    """
+    content = json.dumps([route, params, version], sort_keys=True)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_response(key:str, client=None):
+    """
+    Description:
+    -----------
+        - Looks a response up in memory, then in redis if a client is given.
+            Responses found in redis are kept in memory for the next requests.
+
+    Args:
+    -----------
+        - key: see response_key()
+        - client: redis client of the shared tier (None to only use memory)
+
+    Returns:
+    -----------
+        - Tuple of the cached body and headers, or None on a cache miss
+    """
+    with _responses_lock:
+        if key in _responses:
+            _responses.move_to_end(key)
+            return _responses[key][0]
+    if client is None:
+        return None
+    value = client.get(RESPONSE_KEY.format(key))
+    if value is None:
+        return None
+    body, headers = json.loads(value)
+    _remember(key, (body, headers), len(value))
+    return body, headers
+
+
+def put_response(key:str, body, headers:dict, client=None, ttl:int=RESPONSE_CACHE_TTL) -> None:
+    """
+    Description:
+    -----------
+        - Stores a response in memory, and in redis if a client is given.
+            Responses larger than RESPONSE_CACHE_MAX_ENTRY_BYTES once
+            serialized are not stored.
+
+    Args:
+    -----------
+        - key: see response_key()
+        - body: JSON serializable response body
+        - headers: response headers (dict)
+        - client: redis client of the shared tier (None to only use memory)
+        - ttl: seconds the response is kept in redis (int)
+    """
+    value = json.dumps([body, headers])
+    if len(value) > RESPONSE_CACHE_MAX_ENTRY_BYTES:
+        return
+    _remember(key, (body, headers), len(value))
+    if client is not None:
+        client.set(RESPONSE_KEY.format(key), value, ex=ttl)
+
+
+def _remember(key:str, response:tuple, size:int) -> None:
+    """
+    Adds a response of `size` serialized bytes to the in-memory tier, evicting
+    the least recently used ones past RESPONSE_CACHE_SIZE entries or RESPONSE_CACHE_BYTES.
+    """
+    global _responses_bytes
+    with _responses_lock:
+        if key in _responses:
+            _responses_bytes -= _responses.pop(key)[1]
+        _responses[key] = (response, size)
+        _responses_bytes += size
+        while len(_responses) > RESPONSE_CACHE_SIZE or _responses_bytes > RESPONSE_CACHE_BYTES:
+            _responses_bytes -= _responses.popitem(last=False)[1][1]
+
+
+def clear_responses() -> None:
+    """Empties the in-memory tier, e.g. once the dataset version changed (see atx_traffic.cached_response())."""
+    global _responses_bytes
+    with _responses_lock:
+        _responses.clear()
+        _responses_bytes = 0
@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import time
+# result_cache.py
+# Results of finished plot jobs, addressed by a hash of everything the plot
+# depends on: job type, time window, plot parameters and dataset version.
+# A job identical to a previous one completes with the previous image
+# instead of reading, rendering and uploading it again. Entries expire
+# after RESULT_CACHE_TTL seconds and only the RESULT_CACHE_SIZE most
+# recently used ones are kept. Loading new incidents changes the dataset
+# version, so the results of older data are never served again.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 24 * 3600))
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))
+RESULT_KEY = 'result:{}'
+RESULT_LRU_KEY = 'result:lru' # sorted set of result keys scored by their last use
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def result_key(job_type:str, start, end, params:dict, version:str) -> str:
+    """
+    Description:
+    -----------
+        - Builds the cache key of a plot job. Parameters are serialized with
+            sorted keys so that the order they were sent in does not matter.
+
+    Args:
+    -----------
+        - job_type: e.g. 'plot-heatmap' (string)
+        - start, end: time window of the job, as stored on the job
+        - params: plot parameters of the job (dict)
+        - version: dataset version the plot is made from (string)
+
+    Returns:
+    -----------
+        - Redis key of the cached result (string)
+    """
+    content = json.dumps([job_type, str(start), str(end), params or {}, version], sort_keys=True)
+    return RESULT_KEY.format(hashlib.sha256(content.encode('utf-8')).hexdigest())
+
+
+def get_cached_result(client, key:str, ttl:int=RESULT_CACHE_TTL):
+    """
+    Description:
+    -----------
+        - Looks a result up and marks it as recently used
+
+    Args:
+    -----------
+        - client: redis client of the result cache
+        - key: see result_key()
+        - ttl: seconds the entry is kept from now on (int)
+
+    Returns:
+    -----------
+        - Results of the earlier job (dict), or None on a cache miss
+    """
+    pipe = client.pipeline(transaction=False)
+    pipe.get(key)
+    pipe.expire(key, ttl)
+    pipe.zadd(RESULT_LRU_KEY, {key: time.time()}, xx=True)
+    value = pipe.execute()[0]
+    if value is None:
+        client.zrem(RESULT_LRU_KEY, key)
+        return None
+    return json.loads(value)
+
+
+def cache_result(client, key:str, results:dict, ttl:int=RESULT_CACHE_TTL,
+                 size:int=RESULT_CACHE_SIZE) -> None:
+    """
+    Description:
+    -----------
+        - Stores the results of a finished job, then evicts the least recently
+            used entries beyond `size`
+
+    Args:
+    -----------
+        - client: redis client of the result cache
+        - key: see result_key()
+        - results: results saved on the job (dict)
+        - ttl: seconds the entry is kept (int)
+        - size: maximum number of entries (int)
+    """
+    pipe = client.pipeline()
+    pipe.set(key, json.dumps(results), ex=ttl)
+    pipe.zadd(RESULT_LRU_KEY, {key: time.time()})
+    pipe.zrange(RESULT_LRU_KEY, 0, -size - 1)
+    evicted = pipe.execute()[-1]
+    if evicted:
+        pipe = client.pipeline()
+        pipe.delete(*evicted)
+        pipe.zrem(RESULT_LRU_KEY, *evicted)
+        pipe.execute()
+        print(f"evicted {len(evicted)} cached results")
+
+
+def clear_results(client) -> None:
+    """Drops every cached result, e.g. once their images were deleted."""
+    client.flushdb()
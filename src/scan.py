@@ -0,0 +1,62 @@
+import itertools
+import os
+from typing import Iterable, Iterator, Tuple
+# scan.py
+# Non blocking iteration over redis keys. SCAN/SSCAN return a few keys per
+# call (COUNT is only a hint), so other clients, including the HotQueue,
+# are served in between. String values are then fetched with pipelined
+# GETs, one round-trip per batch; incident records are read through
+# storage.py, which knows their storage format.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+SCAN_COUNT = int(os.environ.get('SCAN_COUNT', 1000))
+FETCH_BATCH_SIZE = int(os.environ.get('FETCH_BATCH_SIZE', 500))
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def batched(iterable:Iterable, size:int) -> Iterator[list]:
+    """Splits `iterable` into lists of at most `size` items."""
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def scan_keys(client, match:str=None, count:int=SCAN_COUNT) -> Iterator:
+    """
+    Description:
+    -----------
+        - Iterates over the keys of a database with SCAN instead of KEYS.
+            Keys written or deleted during the iteration may or may not be
+            returned, and a key can (rarely) be returned twice.
+
+    Args:
+    -----------
+        - client: redis client
+        - match: optional glob style pattern the keys must match (string)
+        - count: number of keys redis looks at per SCAN call (int)
+
+    Returns:
+    -----------
+        - Iterator of keys
+    """
+    return client.scan_iter(match=match, count=count)
+
+
+def scan_set(client, key:str, count:int=SCAN_COUNT) -> Iterator:
+    """Iterates over the members of the set `key` with SSCAN instead of SMEMBERS."""
+    return client.sscan_iter(key, count=count)
+
+
+def iter_values(client, keys:Iterable, batch_size:int=FETCH_BATCH_SIZE) -> Iterator[Tuple]:
+    """Fetches plain string keys with one pipelined GET round-trip per `batch_size` keys. Yields (key, value) tuples."""
+    for batch in batched(keys, batch_size):
+        pipe = client.pipeline(transaction=False)
+        for key in batch:
+            pipe.get(key)
+        yield from zip(batch, pipe.execute())
@@ -0,0 +1,199 @@
+import bisect
+import threading
+import geopy.distance
+import numpy as np
+from dataset import incident_keys, get_dataset_version, to_number, GEO_RADIUS_MARGIN
+from query import encode_cursor, decode_cursor
+from async_fetch import iter_incidents_concurrently
+from typing import List, Tuple
+# snapshot.py
+# Columnar in-memory copy of db 0 held by each API process. Query
+# parameters are evaluated as vectorized boolean masks over NumPy arrays and
+# only the matching incidents are then fetched from redis. The snapshot is
+# reloaded whenever the dataset version (see dataset.bump_dataset_version)
+# changes.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+SNAPSHOT_FIELDS = ('published_date', 'issue_reported', 'traffic_report_status', 'latitude', 'longitude')
+EARTH_RADIUS_MILES = 3958.7613
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def load_snapshot(client, version:str='') -> dict:
+    """
+    Description:
+    -----------
+        - Reads the queried columns of every incident (SSCAN + concurrent pipelined reads)
+            into NumPy arrays sorted by (published_date, id), the order of the
+            query results. Issue types and statuses are dictionary encoded as
+            integer codes of their lower case value. Incidents without a
+            published_date are left out, as they are from the published_date index.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - version: dataset version the snapshot was read at (string)
+
+    Returns:
+    -----------
+        - Dictionary with the following keys:
+            - version: the version argument
+            - ids: incident ids (list)
+            - published, lat, lon: float64 arrays (NaN for missing coordinates)
+            - issue, status: int32 code arrays
+            - issue_codes, status_codes: dictionaries of lower case value -> code
+    """
+    rows = []
+    issue_codes = {}
+    status_codes = {}
+    for key, incident in iter_incidents_concurrently(client, incident_keys(client), SNAPSHOT_FIELDS):
+        published = to_number(incident['published_date'])
+        if published is None:
+            continue
+        lat = to_number(incident['latitude'])
+        lon = to_number(incident['longitude'])
+        rows.append((published, key,
+                     issue_codes.setdefault((incident['issue_reported'] or '').lower(), len(issue_codes)),
+                     status_codes.setdefault((incident['traffic_report_status'] or '').lower(), len(status_codes)),
+                     np.nan if lat is None or lon is None else lat,
+                     np.nan if lat is None or lon is None else lon))
+    rows.sort(key=lambda row: (row[0], row[1]))
+    return {'version': version,
+            'ids': [row[1] for row in rows],
+            'published': np.array([row[0] for row in rows], dtype=np.float64),
+            'issue': np.array([row[2] for row in rows], dtype=np.int32),
+            'status': np.array([row[3] for row in rows], dtype=np.int32),
+            'lat': np.array([row[4] for row in rows], dtype=np.float64),
+            'lon': np.array([row[5] for row in rows], dtype=np.float64),
+            'issue_codes': issue_codes,
+            'status_codes': status_codes}
+
+
+def get_snapshot(client) -> dict:
+    """
+    Description:
+    -----------
+        - Returns the snapshot of the current dataset version, reloading it
+            first if the dataset changed since it was taken. Costs one GET when
+            the snapshot is up to date.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+
+    Returns:
+    -----------
+        - Snapshot dictionary (see load_snapshot())
+    """
+    global _snapshot
+    version = get_dataset_version(client)
+    snapshot = _snapshot
+    if snapshot is not None and snapshot['version'] == version:
+        return snapshot
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot['version'] != version:
+            print(f"loading snapshot of dataset version '{version}'")
+            _snapshot = load_snapshot(client, version)
+        return _snapshot
+
+
+def haversine_miles(lat:float, lon:float, lats:np.ndarray, lons:np.ndarray) -> np.ndarray:
+    """Vectorized great circle distance (spherical earth) in miles from (lat, lon) to every point."""
+    lat, lon = np.radians(lat), np.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(a))
+
+
+def _start_index(snapshot:dict, cursor:str) -> int:
+    """Index of the first row after the (published_date, id) position of `cursor`."""
+    if not cursor:
+        return 0
+    published, key = decode_cursor(cursor)
+    index = int(np.searchsorted(snapshot['published'], published, side='left'))
+    stop = int(np.searchsorted(snapshot['published'], published, side='right'))
+    # rows sharing the published_date are sorted by id
+    return bisect.bisect_right(snapshot['ids'], key, index, stop)
+
+
+def query_mask(snapshot:dict, incident_type:str='all', status:str='all', start:float=float('-inf'),
+               end:float=float('inf'), radius:float=float('inf'), lng:float=None,
+               lat:float=None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Description:
+    -----------
+        - Evaluates the query parameters (see query.compile_filter()) over the
+            whole snapshot at once. The radius uses a vectorized haversine:
+            points clearly inside or outside the radius are settled right away
+            and only points within GEO_RADIUS_MARGIN of the edge, where the
+            spherical and the geodesic distances may disagree, are flagged for
+            an exact check.
+
+    Args:
+    -----------
+        - snapshot: snapshot dictionary (see load_snapshot())
+        - every other argument is described in query.compile_filter()
+
+    Returns:
+    -----------
+        - Tuple of two boolean arrays: the rows that may match, and among them
+            the rows still needing an exact geodesic distance check
+    """
+    mask = (snapshot['published'] >= start) & (snapshot['published'] <= end)
+    if incident_type.lower() != 'all':
+        code = snapshot['issue_codes'].get(incident_type.lower(), -1)
+        mask &= snapshot['issue'] == code
+    if status.lower() != 'all':
+        code = snapshot['status_codes'].get(status.lower(), -1)
+        mask &= snapshot['status'] == code
+    needs_check = np.zeros(len(mask), dtype=bool)
+    if radius != float('inf'):
+        with np.errstate(invalid='ignore'):
+            distance = haversine_miles(lat, lng, snapshot['lat'], snapshot['lon'])
+            mask &= distance <= radius * GEO_RADIUS_MARGIN # NaN coordinates never match
+            needs_check = mask & (distance > radius * (2 - GEO_RADIUS_MARGIN))
+    return mask, needs_check
+
+
+def snapshot_filter_incidents(client, incident_type:str='all', status:str='all', start:float=float('-inf'),
+                              end:float=float('inf'), radius:float=float('inf'), lng:float=None,
+                              lat:float=None, offset:int=0, limit:int=None,
+                              cursor:str=None) -> Tuple[List[dict], str]:
+    """
+    Description:
+    -----------
+        - Same contract as query.filter_incidents(), evaluated on the in-memory
+            snapshot. Only the incidents of the returned page are fetched from redis.
+
+    Returns:
+    -----------
+        - Tuple of the matching incidents (list of dicts, ordered by published_date)
+            and the cursor of the next page (None once the last page was returned)
+    """
+    if limit is not None and limit <= 0:
+        return [], None
+    snapshot = get_snapshot(client)
+    mask, needs_check = query_mask(snapshot, incident_type, status, start, end, radius, lng, lat)
+    mask[:_start_index(snapshot, cursor)] = False
+    page = []
+    skipped = 0
+    next_cursor = None
+    for index in np.flatnonzero(mask):
+        if needs_check[index]:
+            point = (snapshot['lat'][index], snapshot['lon'][index])
+            if geopy.distance.geodesic((lat, lng), point).miles > radius:
+                continue
+        if skipped < offset:
+            skipped += 1
+            continue
+        page.append(index)
+        if limit is not None and len(page) >= limit:
+            next_cursor = encode_cursor((float(snapshot['published'][index]), snapshot['ids'][index]))
+            break
+    keys = [snapshot['ids'][index] for index in page]
+    return [incident for _, incident in iter_incidents_concurrently(client, keys) if incident], next_cursor
@@ -0,0 +1,357 @@
+import base64
+import json
+import math
+import os
+import struct
+import threading
+import uuid
+import numpy as np
+from scan import batched, FETCH_BATCH_SIZE
+from typing import Iterable, Iterator, List, Tuple
+# storage.py
+# How incidents are laid out in redis, the only module reading or writing
+# them. Two formats, selected by STORAGE_FORMAT (the API and the worker must
+# use the same one, switching requires DELETE /incidents and a reload):
+#   - 'hash': one hash of string fields per incident
+#   - 'packed': one string per incident: a fixed size binary header with the
+#       epoch times as int64, the coordinates as float32 and issue/status as
+#       dictionary codes, followed by the remaining fields as compact JSON.
+#       The id (the key itself) and a location matching the coordinates are
+#       not stored. The header is base85 encoded so that packed records can
+#       be read by the same decode_responses=True clients as everything else.
+#       Coordinates (and the location rebuilt from them) come back with
+#       float32 precision, under a meter around Austin.
+
+########################
+### GLOBAL VARIABLES ###
+########################
+STORAGE_FORMATS = ('hash', 'packed')
+STORAGE_FORMAT = os.environ.get('STORAGE_FORMAT', 'hash')
+DICTIONARY_KEY = 'dict:{}' # hash of value -> code of a dictionary encoded field
+DICTIONARY_EPOCH_KEY = 'dict:epoch' # changes when the dictionaries start over (e.g. after a flush)
+CODED_FIELDS = ('issue_reported', 'traffic_report_status')
+HEADER = struct.Struct('<BqqffHH') # flags, published, updated, latitude, longitude, issue code, status code
+HEADER_SIZE = len(base64.b85encode(bytes(HEADER.size)))
+MAX_CODE = 2 ** 16 - 1 # larger codes are kept as plain values
+# flags of the header: which fields it holds, and how the location was written
+PUBLISHED, UPDATED, LATITUDE, LONGITUDE, ISSUE, STATUS, LOCATION_COMMA, LOCATION_COMMA_SPACE = \
+        (1 << bit for bit in range(8))
+# returns the code of every value of ARGV[2..] in the dictionary KEYS[1], adding the missing ones
+ASSIGN_CODES_SCRIPT = """
+redis.call('SET', KEYS[2], ARGV[1], 'NX')
+local codes = {}
+for i = 2, #ARGV do
+    local code = redis.call('HGET', KEYS[1], ARGV[i])
+    if not code then
+        code = redis.call('HLEN', KEYS[1])
+        redis.call('HSET', KEYS[1], ARGV[i], code)
+    end
+    codes[i - 1] = tonumber(code)
+end
+return codes
+"""
+_dictionaries = {'epoch': None}
+_dictionaries_lock = threading.Lock()
+
+########################
+### HELPER FUNCTIONS ###
+########################
+def _int_field(value):
+    """The integer a string field holds if it round-trips exactly, else None."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if str(number) == value and -2 ** 63 <= number < 2 ** 63 else None
+
+
+def _float_field(value):
+    """The float a string field holds if it fits a float32, else None."""
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if math.isfinite(number) and abs(number) < 1e38 else None
+
+
+def _float32_string(value:float) -> str:
+    """Shortest string reading back as the same float32."""
+    return str(np.float32(value))
+
+
+def encode_incident(incident:dict, codes:dict) -> str:
+    """
+    Description:
+    -----------
+        - Packs an incident into a 'packed' record. Fields that do not fit the
+            header (e.g. a non numeric published_date) are kept as they are
+            with the other fields.
+
+    Args:
+    -----------
+        - incident: incident dictionary (see ingest.clean_incident())
+        - codes: code of each value of CODED_FIELDS, {field: {value: code}} (see assign_codes())
+
+    Returns:
+    -----------
+        - Record stored in redis (string)
+    """
+    # redis stores the repr of numbers written to a hash, so does this format
+    rest = {field: value if isinstance(value, str) else repr(value) for field, value in incident.items()}
+    rest.pop('traffic_report_id', None)
+    flags = 0
+    values = [0, 0, 0.0, 0.0, 0, 0]
+    for index, (field, flag, parse) in enumerate((('published_date', PUBLISHED, _int_field),
+                                                  ('traffic_report_status_date_time', UPDATED, _int_field),
+                                                  ('latitude', LATITUDE, _float_field),
+                                                  ('longitude', LONGITUDE, _float_field))):
+        number = parse(rest.get(field))
+        if number is not None:
+            values[index] = number
+            flags |= flag
+            del rest[field]
+    for index, (field, flag) in enumerate(((CODED_FIELDS[0], ISSUE), (CODED_FIELDS[1], STATUS)), start=4):
+        if field in rest and codes[field][rest[field]] <= MAX_CODE:
+            values[index] = codes[field][rest.pop(field)]
+            flags |= flag
+    if flags & LATITUDE and flags & LONGITUDE and 'location' in rest:
+        lat, lon = _float32_string(values[2]), _float32_string(values[3])
+        if rest['location'] in (f"({incident['latitude']},{incident['longitude']})", f'({lat},{lon})'):
+            flags |= LOCATION_COMMA
+            del rest['location']
+        elif rest['location'] in (f"({incident['latitude']}, {incident['longitude']})", f'({lat}, {lon})'):
+            flags |= LOCATION_COMMA_SPACE
+            del rest['location']
+    header = base64.b85encode(HEADER.pack(flags, *values)).decode('ascii')
+    return header + json.dumps(rest, separators=(',', ':'), ensure_ascii=False)
+
+
+def decode_incident(key:str, record:str, dictionaries:dict) -> dict:
+    """
+    Description:
+    -----------
+        - Unpacks a record made by encode_incident()
+
+    Args:
+    -----------
+        - key: key of the record, the traffic_report_id of the incident
+        - record: the stored record (string)
+        - dictionaries: values of each code, {field: [value, ...]} (see get_dictionaries())
+
+    Returns:
+    -----------
+        - Incident dictionary, with string fields like the 'hash' format
+    """
+    flags, published, updated, lat, lon, issue, status = HEADER.unpack(base64.b85decode(record[:HEADER_SIZE]))
+    incident = {'traffic_report_id': key}
+    if flags & PUBLISHED:
+        incident['published_date'] = str(published)
+    if flags & UPDATED:
+        incident['traffic_report_status_date_time'] = str(updated)
+    if flags & LATITUDE:
+        incident['latitude'] = _float32_string(lat)
+    if flags & LONGITUDE:
+        incident['longitude'] = _float32_string(lon)
+    if flags & ISSUE:
+        incident['issue_reported'] = dictionaries[CODED_FIELDS[0]][issue]
+    if flags & STATUS:
+        incident['traffic_report_status'] = dictionaries[CODED_FIELDS[1]][status]
+    if flags & LOCATION_COMMA:
+        incident['location'] = f"({incident['latitude']},{incident['longitude']})"
+    elif flags & LOCATION_COMMA_SPACE:
+        incident['location'] = f"({incident['latitude']}, {incident['longitude']})"
+    incident.update(json.loads(record[HEADER_SIZE:]))
+    return incident
+
+
+def assign_codes(client, incidents:List[dict]) -> dict:
+    """
+    Description:
+    -----------
+        - Gets (and creates when needed) the dictionary codes of the
+            CODED_FIELDS values of a batch of incidents, in one round-trip.
+            Codes are never reassigned while the dictionaries exist.
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - incidents: batch of incidents about to be written (list of dicts)
+
+    Returns:
+    -----------
+        - {field: {value: code}} for every value of the batch
+    """
+    pipe = client.pipeline(transaction=False)
+    script = client.register_script(ASSIGN_CODES_SCRIPT)
+    values = {}
+    for field in CODED_FIELDS:
+        values[field] = sorted({str(incident[field]) for incident in incidents if field in incident})
+        script(keys=[DICTIONARY_KEY.format(field), DICTIONARY_EPOCH_KEY], args=[uuid.uuid4().hex] + values[field],
+               client=pipe)
+    return {field: dict(zip(values[field], codes)) for field, codes in zip(CODED_FIELDS, pipe.execute())}
+
+
+def get_dictionaries(client, epoch:str, codes:Iterable[Tuple[int, int]]=()) -> dict:
+    """
+    Description:
+    -----------
+        - Returns the values of the dictionary codes, kept in memory and read
+            again from redis when the dictionaries were started over or when
+            one of `codes` is not known yet
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - epoch: current value of DICTIONARY_EPOCH_KEY (string)
+        - codes: (issue code, status code) pairs about to be decoded
+
+    Returns:
+    -----------
+        - {field: [value of code 0, value of code 1, ...]}
+    """
+    dictionaries = _dictionaries
+    if dictionaries['epoch'] == epoch and all(issue < len(dictionaries[CODED_FIELDS[0]]) and
+                                              status < len(dictionaries[CODED_FIELDS[1]])
+                                              for issue, status in codes):
+        return dictionaries
+    with _dictionaries_lock:
+        pipe = client.pipeline(transaction=False)
+        pipe.get(DICTIONARY_EPOCH_KEY)
+        for field in CODED_FIELDS:
+            pipe.hgetall(DICTIONARY_KEY.format(field))
+        epoch, *stored = pipe.execute()
+        dictionaries = {'epoch': epoch}
+        for field, dictionary in zip(CODED_FIELDS, stored):
+            values = [None] * len(dictionary)
+            for value, code in dictionary.items():
+                values[int(code)] = value
+            dictionaries[field] = values
+        _dictionaries.clear()
+        _dictionaries.update(dictionaries)
+        return dictionaries
+
+
+def _decode_records(client, keys:List[str], records:List[str], epoch:str) -> List[dict]:
+    """Decodes the records of `keys` ({} for keys without a record)."""
+    headers = [HEADER.unpack(base64.b85decode(record[:HEADER_SIZE])) for record in records if record]
+    dictionaries = get_dictionaries(client, epoch, ((header[5], header[6]) for header in headers))
+    return [decode_incident(key, record, dictionaries) if record else {} for key, record in zip(keys, records)]
+
+
+def store_incident(pipe, incident:dict, codes:dict=None, storage_format:str=STORAGE_FORMAT) -> None:
+    """
+    Description:
+    -----------
+        - Queues the command writing an incident on a pipeline
+
+    Args:
+    -----------
+        - pipe: redis pipeline of the incidents database
+        - incident: incident dictionary (see ingest.clean_incident())
+        - codes: dictionary codes of the batch, 'packed' format only (see assign_codes())
+        - storage_format: one of STORAGE_FORMATS
+    """
+    if storage_format == 'packed':
+        pipe.set(incident['traffic_report_id'], encode_incident(incident, codes))
+    else:
+        pipe.hset(incident['traffic_report_id'], mapping=incident)
+
+
+def queue_reads(pipe, keys:List[str], fields:Tuple[str, ...]=None, storage_format:str=STORAGE_FORMAT) -> None:
+    """Queues the commands reading `keys` on a pipeline (sync or redis.asyncio), see parse_reads()."""
+    if storage_format == 'packed':
+        pipe.get(DICTIONARY_EPOCH_KEY)
+        for key in keys:
+            pipe.get(key)
+        return
+    for key in keys:
+        if fields:
+            pipe.hmget(key, *fields)
+        else:
+            pipe.hgetall(key)
+
+
+def parse_reads(client, keys:List[str], replies:list, fields:Tuple[str, ...]=None,
+                storage_format:str=STORAGE_FORMAT) -> List[dict]:
+    """Turns the replies to queue_reads() into incidents, see read_incidents()."""
+    if storage_format != 'packed':
+        if fields:
+            return [dict(zip(fields, values)) for values in replies]
+        return replies
+    epoch, *records = replies
+    incidents = _decode_records(client, keys, records, epoch)
+    if fields:
+        return [{field: incident.get(field) for field in fields} for incident in incidents]
+    return incidents
+
+
+def read_incidents(client, keys:List[str], fields:Tuple[str, ...]=None,
+                   storage_format:str=STORAGE_FORMAT) -> List[dict]:
+    """
+    Description:
+    -----------
+        - Fetches several incidents in one pipelined round-trip
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - keys: incident keys (list)
+        - fields: only return these fields instead of the whole incident
+        - storage_format: one of STORAGE_FORMATS
+
+    Returns:
+    -----------
+        - One dictionary per key, in the order of `keys` ({} for keys that do not
+            exist when fetching whole incidents, None values when fetching fields)
+    """
+    pipe = client.pipeline(transaction=False)
+    queue_reads(pipe, keys, fields, storage_format)
+    return parse_reads(client, keys, pipe.execute(), fields, storage_format)
+
+
+def iter_incidents(client, keys:Iterable, fields:Tuple[str, ...]=None, batch_size:int=FETCH_BATCH_SIZE,
+                   storage_format:str=STORAGE_FORMAT) -> Iterator[Tuple[str, dict]]:
+    """
+    Description:
+    -----------
+        - Fetches the incidents of `keys` (typically from dataset.incident_keys())
+            with one pipelined round-trip per `batch_size` keys
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - keys: incident keys
+        - fields, storage_format: see read_incidents()
+        - batch_size: number of keys fetched per round-trip (int)
+
+    Returns:
+    -----------
+        - Iterator of (key, incident) tuples
+    """
+    for batch in batched(keys, batch_size):
+        yield from zip(batch, read_incidents(client, batch, fields, storage_format))
+
+
+def parse_stored(client, keys:List[str], stored:list, epoch:str=None,
+                 storage_format:str=STORAGE_FORMAT) -> List[dict]:
+    """
+    Description:
+    -----------
+        - Turns what a server side script read for several incidents (flat
+            HGETALL replies or packed records) into incident dictionaries
+
+    Args:
+    -----------
+        - client: redis client of the incidents database
+        - keys: keys of the incidents (list)
+        - stored: values read by the script, in the order of `keys` (list)
+        - epoch: value of DICTIONARY_EPOCH_KEY, 'packed' format only
+        - storage_format: one of STORAGE_FORMATS
+
+    Returns:
+    -----------
+        - One incident dictionary per key ({} if nothing was stored)
+    """
+    if storage_format == 'packed':
+        return _decode_records(client, keys, [record or None for record in stored], epoch)
+    return [dict(zip(flat[::2], flat[1::2])) for flat in stored]
@@ -1,15 +1,33 @@
+import matplotlib
+matplotlib.use('Agg') # render without a display, also in the executor processes
 import matplotlib.pyplot as plt
-from jobs import queue, update_job_status, get_job_by_id, add_job, delete_all_jobs, rd_details
-from atx_traffic import post_incidents_data,rd
+from jobs import queue, update_job_status, get_job_by_id, add_job, delete_all_jobs, rd, rd_staging, rd_locks, \
+        rd_details, rd_results, rd_images
+from ingest import load_incidents, INGEST_MODES
+from plots import load_plot_data, load_grid_counts, time_histogram, IMAGE_FORMATS
+from cube import grid_edges, GRID_BBOX, GRID_SHAPE
+from PIL import Image
+from image_store import save_image, delete_stored_image
+from result_cache import result_key, get_cached_result, cache_result, clear_results
+from dataset import get_dataset_version
+from scan import scan_keys
+from connections import close_pools
 import datetime
-import json
-import requests
+import io
+import multiprocessing
+import numpy as np
 import os
-access_token = os.environ.get("IMAGUR_ACCESS_TOKEN", "967ffa0d6f32d43b44578bac270e080f506ae998")
-imagur_auth = f'Bearer {access_token}'
-imagur_image_endpoint = "https://api.imgur.com/3/image"
+import signal
+import sys
+# number of jobs executed concurrently by this worker, one process each
+worker_processes = int(os.environ.get("WORKER_PROCESSES", 1))
+# map plots: bounding box (min lon, max lon, min lat, max lat) and background,
+# decoded once at startup and shared by the executor processes
+MAP_BBOX = GRID_BBOX
+basemap = plt.imread(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'map.png'))
+# figures reused from job to job, one per plot type (see _template())
+_templates = {}
 # worker.py
-@queue.worker # decorator keeps function "live" and always reading new messages from the queue
 def _execute_job(jid:str) -> None:
     """
     Retrieve a job id from the task queue and execute the job.
@@ -20,6 +38,20 @@ def _execute_job(jid:str) -> None:
     print("retrieved job:", job)
     if job:
         job_type = job.get("job_type")
+        if job_type in ("plot-timeseries", "plot-dotmap", "plot-heatmap"):
+            # an identical plot of the same data was already made, reuse its image
+            try:
+                cache_key = result_key(job_type, job.get("start"), job.get("end"), job.get("params"),
+                                       get_dataset_version(rd))
+                cached = get_cached_result(rd_results, cache_key)
+            except Exception as e:
+                # the result cache is an optimization, the plot is made again
+                print(f"ERROR: unable to look up the results of identical jobs: {e}")
+                cache_key, cached = None, None
+            if cached:
+                print(f"reusing the results of an identical {job_type} job")
+                update_job_status(jid, 'completed', cached)
+                return
         if job_type == "plot-timeseries":
             try:
                 try:
@@ -32,44 +64,24 @@ def _execute_job(jid:str) -> None:
                     end = None
                     start_string = None
                     end_string = None
-                years = []
-                counts = []
-                for key in rd.keys():
-                    try:
-                        unix_time = int(rd.hget(key, 'published_date'))
-                        val = rd.hget(key, 'issue_reported"')
-                        year = datetime.datetime.fromtimestamp(unix_time).strftime('%Y')
-                        if (start is None \
-                                or start <= unix_time) \
-                                and (end is None \
-                                or end >= unix_time):
-                            # Either increase the count bin for a year
-                            # Or create a new year bin with a count of 1
-                            if year in years:
-                                ind = years.index(year)
-                                counts[ind] = counts[ind] + 1
-                            else:
-                                years.append(year)
-                                counts.append(1)
-                    except Exception as e:
-                        print(e)
-                        continue
-                fig, ax = plt.subplots()
-                counts = [count for _, count in sorted(zip(years, counts))] # sort counts by year
-                years = sorted(years) # now sort years
-                ax.bar(years, counts)
+                granularity = job.get("params", {}).get("granularity", "year")
+                labels, counts = time_histogram(load_plot_data(rd, start, end)['published'], granularity)
                 if start is None or end is None:
-                    plt.title('Cases over Time')
+                    title = 'Cases over Time'
                 else:
-                    plt.title(f'Cases from {start_string} to {end_string}')
-                plt.savefig('src/plot.png') # temporarily saves in worker directory
-                # now upload image to imagur, then update job status and return
-                image_dict = upload_image('src/plot.png')
+                    title = f'Cases from {start_string} to {end_string}'
+                fig = draw_timeseries(labels, counts, title)
+                # rendered in memory, concurrent jobs never share a file
+                image_format, dpi = image_options(job)
+                image = render_image(fig, image_format, dpi)
+                # now store the image, then update job status and return
+                image_dict = save_image(rd_images, image, image_format)
                 if image_dict:
                     update_job_status(jid, 'completed', image_dict)
+                    remember_result(cache_key, image_dict)
                 else:
-                    print("ERROR Uploading image to imagur, adding job back into the queue")
-                    add_job(job["start"], job["end"], job["type"])
+                    print("ERROR Uploading image, adding job back into the queue")
+                    add_job(job["start"], job["end"], job_type, params=job.get("params"))
                     return 
                 # with open('plot.png') as f:
                 #     img = f.read()
@@ -91,41 +103,24 @@ def _execute_job(jid:str) -> None:
                     end = None
                     start_string = None
                     end_string = None
-                lats = []
-                lons = []
-                for key in rd.keys():
-                    try:
-                        unix_time = int(rd.hget(key, 'published_date'))
-                        lat = rd.hget(key, 'latitude')
-                        lon = rd.hget(key, 'longitude')
-                        lat = float(lat)
-                        lon = float(lon)
-                        if (start is None \
-                                or start <= unix_time) \
-                                and (end is None \
-                                or end >= unix_time):
-                                    lats.append(lat)
-                                    lons.append(lon)
-                    except:
-                        continue
-                BBox = (-98.9,-97.0, 30.0, 31.1)
-                mp = plt.imread('src/map.png')
-                fig, ax = plt.subplots()
-                ax.scatter(lons, lats, zorder=1, alpha= 0.2, c='b', s=10)
-                ax.set_xlim(BBox[0],BBox[1])
-                ax.set_ylim(BBox[2],BBox[3])
-                ax.imshow(mp, zorder=0, extent = BBox, aspect= 'equal')
+                data = load_plot_data(rd, start, end)
+                lats = data['lat']
+                lons = data['lon']
                 if start is None or end is None:
-                    plt.title('Cases over Time')
+                    title = 'Cases over Time'
                 else:
-                    plt.title(f'Cases from {start_string} to {end_string}')
-                plt.savefig('src/plot.png') # temporarily saves in worker directory
-                image_dict = upload_image('src/plot.png')
+                    title = f'Cases from {start_string} to {end_string}'
+                fig = draw_dotmap(lats, lons, title)
+                # rendered in memory, concurrent jobs never share a file
+                image_format, dpi = image_options(job)
+                image = render_image(fig, image_format, dpi)
+                image_dict = save_image(rd_images, image, image_format)
                 if image_dict:
                     update_job_status(jid, 'completed', image_dict)
+                    remember_result(cache_key, image_dict)
                 else:
-                    print("ERROR Uploading image to imagur, adding job back into the queue")
-                    add_job(job["start"], job["end"], job["type"])
+                    print("ERROR Uploading image, adding job back into the queue")
+                    add_job(job["start"], job["end"], job_type, params=job.get("params"))
                     return 
                 # with open('plot.png') as f:
                 #     img = f.read()
@@ -147,47 +142,24 @@ def _execute_job(jid:str) -> None:
                     end = None
                     start_string = None
                     end_string = None
-                lats = []
-                lons = []
-                for key in rd.keys():
-                    try:
-                        unix_time = int(rd.hget(key, 'published_date'))
-                        lat = rd.hget(key, 'latitude')
-                        lon = rd.hget(key, 'longitude')
-                        lat = float(lat)
-                        lon = float(lon)
-                        if (start is None \
-                                or start <= unix_time) \
-                                and (end is None \
-                                or end >= unix_time):
-                                    lats.append(lat)
-                                    lons.append(lon)
-                    except:
-                        continue
-                BBox = (-98.9,-97.0, 30.0, 31.1)
-                mp = plt.imread('src/map.png')
-                fig, ax = plt.subplots()
-                counts, xedges, yedges, im = ax.hist2d(lons, lats, zorder=1, alpha=0.5, cmin=1, \
-                        bins=[int((BBox[1]-BBox[0])/0.01), \
-                        int((BBox[3]-BBox[2])/0.01)], \
-                        range=[[BBox[0], BBox[1]], \
-                        [BBox[2], BBox[3]]])
-                ax.set_xlim(BBox[0],BBox[1])
-                ax.set_ylim(BBox[2],BBox[3])
-                ax.imshow(mp, zorder=0, extent = BBox, aspect= 'equal')
-                fig.colorbar(im, ax=ax)
+                # summed from the count cube, no incident is read for whole days
+                counts = load_grid_counts(rd, rd_locks, start, end)
                 if start is None or end is None:
-                    plt.title('Cases over Time')
+                    title = 'Cases over Time'
                 else:
-                    plt.title(f'Cases from {start_string} to {end_string}')
-                plt.savefig('src/plot.png') # temporarily saves in worker directory
-                # now upload image to imagur, then update job status and return
-                image_dict = upload_image('src/plot.png')
+                    title = f'Cases from {start_string} to {end_string}'
+                fig = draw_heatmap(counts, title)
+                # rendered in memory, concurrent jobs never share a file
+                image_format, dpi = image_options(job)
+                image = render_image(fig, image_format, dpi)
+                # now store the image, then update job status and return
+                image_dict = save_image(rd_images, image, image_format)
                 if image_dict:
                     update_job_status(jid, 'completed', image_dict)
+                    remember_result(cache_key, image_dict)
                 else:
-                    print("ERROR Uploading image to imagur, adding job back into the queue")
-                    add_job(job["start"], job["end"], job["type"])
+                    print("ERROR Uploading image, adding job back into the queue")
+                    add_job(job["start"], job["end"], job_type, params=job.get("params"))
                     return 
                 # with open('plot.png') as f:
                 #     img = f.read()
@@ -199,23 +171,28 @@ def _execute_job(jid:str) -> None:
             pass
         elif job_type == "incidents":
             try:
-                post_incidents_data()
-                update_job_status(jid, "complete", {"message": "Data uploaded!"})
+                mode = job.get("params", {}).get("mode", "full")
+                if mode not in INGEST_MODES: # checked by the API, jobs queued before that are failed
+                    raise ValueError(f"unknown ingest mode '{mode}'")
+                count = load_incidents(rd, rd_staging, rd_locks, delta=mode == "delta")
+                update_job_status(jid, "complete", {"message": "Data uploaded!", "count": count})
             except Exception as e:
                 print(f"and error occured while trying to post incidents data: {e}")
                 update_job_status(jid, 'failed')
             pass
         elif job_type == "delete":
             print("Recived request to delete job")
-            # first we delete the images from imagur
-            for jid in rd_details.keys():
+            # first we delete the images from their store
+            for job_key in list(scan_keys(rd_details)):
                 try:
-                    delete_image(jid)
+                    delete_image(job_key)
                 except Exception as e:
-                    print(f"ERROR: Unable to delete image with jid: {jid}. Error: {e}")
+                    print(f"ERROR: Unable to delete image with jid: {job_key}. Error: {e}")
             # then we delete the jobs from the redis database
+            # and the cached results pointing to the deleted images
             try:
                 delete_all_jobs()
+                clear_results(rd_results)
             except Exception as e:
                 print(f"ERROR: Unable to delete all jobs from rd_details: {e}")
                 update_job_status(jid, 'failed')
@@ -230,59 +207,158 @@ def _execute_job(jid:str) -> None:
     # 2) start the analysis job and monitor it to completion.
     # 3) update the job status to indicate that the job has finished.
 
-def upload_image(path:str) -> dict:
+def _consume_jobs() -> None:
+    """Executes the jobs of the queue one after the other, until the process is stopped."""
+    try:
+        for jid in queue.consume():
+            _execute_job(jid)
+    finally:
+        close_pools()
+
+
+def run_workers(processes:int=worker_processes) -> None:
     """
     Description
     -----------
-        - Helper function to easily upload host images using the Imagur API.
+        - Runs `processes` job executors side by side, each one pulling job ids
+            from the HotQueue (BLPOP hands every job to a single executor).
+            Processes rather than threads, as rendering is CPU bound.
     Args
     -----------
-        - path: string denoting the path of the file to be uploaded. NOTE: Only png and jpg images can be uploaded to imagur
-
-    Returns
-    -----------
-        - Dictionary object containing the following:
-            - deletehash(str): *key used to later delete the image*.
-            - link(str): *public link to image*
-            - success(bool): *True if successful else false*. 
-            - datetime(int): *denotes time (Epoch in seconds) of image upload. 
+        - processes: number of concurrent executors (int)
     """
-    # retrieving and payload to send to imagur API
-    
-    payload = {}
-    # try to read input file, else print error
-    try:
-        with open(path, 'rb') as f:
-            payload['image'] = f.read()
-    except Exception as e:
-        print(f'EXCEPTION CAUGHT...while trying to read file {path}: {e}')   
+    if processes <= 1:
+        _consume_jobs()
+        return
+    print(f"starting {processes} job executors")
+    executors = [multiprocessing.Process(target=_consume_jobs, name=f"executor-{i}", daemon=True)
+                 for i in range(processes)]
+    for executor in executors:
+        executor.start()
+    for executor in executors:
+        executor.join()
+
+
+def remember_result(cache_key:str, results:dict) -> None:
+    """Caches the results of a completed plot job for identical jobs; a failure only costs a cache miss later."""
+    if cache_key is None:
         return
-    header = {'Authorization': imagur_auth}
-    # try to make post request to imagur, else print errors
     try:
-        response = requests.post(imagur_image_endpoint, headers=header, data=payload)
+        cache_result(rd_results, cache_key, results)
     except Exception as e:
-        print(f'EXCEPTION CAUGHT...while trying to upload file {path} onto imagur: {e}')
-        return
-    if response.status_code == 200:
-        content = json.loads(response.content.decode('utf-8'))
-        return {
-                'id': content['data']['id'],
-                'link': content['data']['link'], 
-                'deletehash': content['data']['deletehash'],
-                'datetime': content['data']['datetime']
-                }
+        print(f"ERROR: unable to cache the results of the job: {e}")
+
+
+def image_options(job:dict) -> tuple:
+    """Output format and resolution (dpi) requested by a plot job (see render_image())."""
+    params = job.get("params", {})
+    return params.get("format", "png"), params.get("dpi")
+
+
+def _template(plot_type:str) -> dict:
+    """
+    Description
+    -----------
+        - Returns the figure of a plot type, creating it on first use. Map
+            plots get the basemap and the axes limits once; the jobs then only
+            update their data artists.
+    Args
+    -----------
+        - plot_type: 'timeseries', 'dotmap' or 'heatmap'
+    Returns
+    -----------
+        - Dictionary holding the figure ('fig'), its axes ('ax') and the data
+            artists of the plot type
+    """
+    template = _templates.get(plot_type)
+    if template is not None:
+        return template
+    fig, ax = plt.subplots()
+    template = {'fig': fig, 'ax': ax}
+    if plot_type != 'timeseries':
+        ax.set_xlim(MAP_BBOX[0], MAP_BBOX[1])
+        ax.set_ylim(MAP_BBOX[2], MAP_BBOX[3])
+        ax.imshow(basemap, zorder=0, extent=MAP_BBOX, aspect='equal')
+    if plot_type == 'dotmap':
+        template['points'] = ax.scatter([], [], zorder=1, alpha=0.2, c='b', s=10)
+    elif plot_type == 'heatmap':
+        xedges, yedges = grid_edges()
+        # empty cells are left transparent, like hist2d(cmin=1)
+        template['mesh'] = ax.pcolormesh(xedges, yedges, np.ma.masked_less(np.zeros(GRID_SHAPE), 1).T,
+                                         zorder=1, alpha=0.5)
+        template['colorbar'] = fig.colorbar(template['mesh'], ax=ax)
+    _templates[plot_type] = template
+    return template
+
+
+def draw_timeseries(labels:list, counts:np.ndarray, title:str):
+    """Draws the bars of a timeseries plot (see plots.time_histogram()) on its reused figure."""
+    template = _template('timeseries')
+    ax = template['ax']
+    ax.clear() # the categories of the previous job must not stay on the x axis
+    ax.bar(labels, counts)
+    # clear() keeps the tick parameters, set them for every job
+    if len(labels) > 24:
+        ax.tick_params(axis='x', labelrotation=90, labelsize='xx-small')
     else:
-        print(f'An error has occured uploading image to imagur. check header: {header}')
-        return
+        ax.tick_params(axis='x', labelrotation=0, labelsize=plt.rcParams['xtick.labelsize'])
+    ax.set_title(title)
+    return template['fig']
+
+
+def draw_dotmap(lats:np.ndarray, lons:np.ndarray, title:str):
+    """Moves the points of the reused dotmap figure to the given coordinates."""
+    template = _template('dotmap')
+    template['points'].set_offsets(np.column_stack([lons, lats]))
+    template['ax'].set_title(title)
+    return template['fig']
+
+
+def draw_heatmap(counts:np.ndarray, title:str):
+    """Fills the grid of the reused heatmap figure with counts from plots.load_grid_counts()."""
+    template = _template('heatmap')
+    mesh = template['mesh']
+    cells = np.ma.masked_less(counts, 1).T
+    mesh.set_array(cells)
+    mesh.set_clim(cells.min() if cells.count() else 1, cells.max() if cells.count() else 1)
+    template['colorbar'].update_normal(mesh)
+    template['ax'].set_title(title)
+    return template['fig']
 
 
+def render_image(fig, image_format:str="png", dpi:float=None) -> io.BytesIO:
+    """
+    Description
+    -----------
+        - Renders a figure into an in-memory buffer. The figure is kept for the
+            next job (see _template()).
+            'png-compressed' reduces the PNG to a 256 color palette, which
+            keeps map plots readable at about a third of the size.
+    Args
+    -----------
+        - fig: matplotlib figure
+        - image_format: one of IMAGE_FORMATS (string)
+        - dpi: resolution of the image (None for the matplotlib default)
+    Returns
+    -----------
+        - BytesIO buffer positioned at the start of the image
+    """
+    buffer = io.BytesIO()
+    options = IMAGE_FORMATS[image_format]
+    fig.savefig(buffer, format=options["format"], dpi=dpi, **options.get("savefig", {}))
+    if image_format == "png-compressed":
+        palette = Image.open(buffer).convert("RGB").quantize(256)
+        buffer = io.BytesIO()
+        palette.save(buffer, format="png", optimize=True)
+    buffer.seek(0)
+    return buffer
+
 
 def delete_image(jid:str) -> bool:
     '''
     Description
     -----------
-        - Deletes image from imagur
+        - Deletes the image of a job from the store it was saved in (see image_store.py)
     Args
     -----------
         - jid(str): Job id that can be used to retrieve job image results
@@ -290,23 +366,14 @@ def delete_image(jid:str) -> bool:
     -----------
         - Boolean True is deletion was successful else False
     '''
-    # deletes each image from image db from imagur
     job = get_job_by_id(jid)
-    image = job.get("results").get("image")
-    print(f"successfully retrieved job: {job} with jid: {jid}")
-    if image and image.get("deletehash") != None:
-        header = {"Authorization": imagur_auth}
-        deletehash = image.get('deletehash')
-        try:
-            requests.delete(f"{imagur_image_endpoint}/{deletehash}", headers=header)
-        except Exception as e:
-            print("ERROR deleting image from imagur: {e}")
-            return False
-    else:
-        print(f"No delete hash attribute found in image: {image}. \
-               Or the image attribute for this job: {job} does not exist")
+    results = job.get("results") or {}
+    if "id" not in results and "deletehash" not in results:
+        print(f"No image attribute found in the results of job: {job}")
         return False
+    return delete_stored_image(rd_images, results)
 
-    return True
-
-_execute_job()
+if __name__ == '__main__':
+    # SIGTERM (docker stop, pod deletion) exits through the finally of _consume_jobs()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    run_workers()
@@ -0,0 +1,30 @@
+import pytest
+
+class RecordingPipeline:
+    """Stands in for a redis pipeline and records the queued commands"""
+    def __init__(self):
+        self.commands = []
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.commands.append((name,) + args + tuple(kwargs.items()))
+
+class RecordingClient:
+    """Stands in for a redis client handing out RecordingPipelines"""
+    def pipeline(self, transaction=True):
+        self.transaction = transaction
+        self.pipe = RecordingPipeline()
+        return self.pipe
+
+@pytest.fixture
+def recording_pipeline():
+    """Makes RecordingPipelines, several per test if needed"""
+    return RecordingPipeline
+
+@pytest.fixture
+def recording_client():
+    return RecordingClient()
+
+@pytest.fixture
+def fake_redis():
+    """Empty in-memory redis database, shared by the clients of one test (see fakeredis)"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True)
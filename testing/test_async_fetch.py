@@ -0,0 +1,24 @@
+import pytest
+import async_fetch
+from async_fetch import iter_incidents_concurrently
+from dataset import ALL_KEY
+from ingest import write_incidents
+from storage import iter_incidents, STORAGE_FORMATS
+
+
+@pytest.mark.parametrize('storage_format', STORAGE_FORMATS)
+def test_iter_incidents_concurrently(storage_format, fake_redis, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fake_redis.connection_pool.connection_kwargs['server']
+    monkeypatch.setattr(async_fetch, 'async_client',
+                        lambda client: fakeredis.aioredis.FakeRedis(server=server, decode_responses=True))
+    write_incidents(fake_redis, [{"traffic_report_id": f"ID_{ii:02d}", "published_date": str(1000 + ii),
+                                  "issue_reported": "Crash Urgent" if ii % 3 else "Traffic Hazard",
+                                  "traffic_report_status": "ACTIVE", "latitude": "30.28", "longitude": "-97.73"}
+                                 for ii in range(20)], storage_format=storage_format)
+    keys = sorted(fake_redis.smembers(ALL_KEY), reverse=True) + ["MISSING"]
+    for fields in (None, ("issue_reported", "published_date")):
+        expected = list(iter_incidents(fake_redis, keys, fields, 3, storage_format))
+        # windows of 3 batches of 3 keys, the last one partial
+        assert list(iter_incidents_concurrently(fake_redis, keys, fields, 3, 3, storage_format)) == expected
+        assert [key for key, _ in expected] == keys
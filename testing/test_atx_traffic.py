@@ -1,7 +1,7 @@
 import pytest
 import time
 import json
-from atx_traffic import get_seconds, is_in_bounds, app
+from atx_traffic import get_seconds, is_in_bounds, check_job_params, app
 from jobs import add_job, delete_all_jobs, clear_queue
 
 def test_get_seconds():
@@ -20,6 +20,16 @@ def test_is_in_bounds():
     assert is_in_bounds(check_address=False, incident=test_incident, radius_range=7, lng=lng, lat=lat) == True
     assert is_in_bounds(check_address=False, incident=test_incident, radius_range=5, lng=lng, lat=lat) == False
     
+def test_check_job_params():
+    assert check_job_params({}) is None
+    assert check_job_params({"granularity": "week", "format": "webp", "dpi": 150}) is None
+    assert "granularity" in check_job_params({"granularity": "decade"})
+    assert "format" in check_job_params({"format": "gif"})
+    assert "dpi" in check_job_params({"dpi": "high"})
+    assert "dpi" in check_job_params({"dpi": 5000})
+    assert check_job_params({"mode": "delta"}) is None and check_job_params({"mode": "full"}) is None
+    assert "mode" in check_job_params({"mode": "dleta"})
+
 def test_add_job():
     assert len(add_job("12-12-2021", "12-12-2022", "incidents")) == 5
 def test_delete_all_jobs():
@@ -0,0 +1,38 @@
+import numpy as np
+from cube import grid_cells, grid_edges, cube_entry, update_cube, incident_day, day_start, \
+        GRID_BBOX, GRID_SHAPE, CUBE_DAY_KEY, CUBE_DAYS_KEY
+
+def test_grid_cells_match_histogram2d():
+    rng = np.random.default_rng(0)
+    lon_edges, lat_edges = grid_edges()
+    # random points, points on the edges and points outside of the box
+    lat = np.concatenate([rng.uniform(29.9, 31.2, 5000), lat_edges, [np.nan]])
+    lon = np.concatenate([rng.uniform(-99.0, -96.9, 5000), lon_edges[:len(lat_edges)], [-97.5]])
+    expected, _, _ = np.histogram2d(lon, lat, bins=GRID_SHAPE,
+                                    range=[[GRID_BBOX[0], GRID_BBOX[1]], [GRID_BBOX[2], GRID_BBOX[3]]])
+    cells = grid_cells(lat, lon)
+    counts = np.bincount(cells[cells >= 0], minlength=GRID_SHAPE[0] * GRID_SHAPE[1])
+    assert (counts.reshape(GRID_SHAPE) == expected).all()
+
+def test_days():
+    # 2023-01-02 00:30 America/Chicago
+    day = incident_day(1672641000)
+    assert day_start(day) <= 1672641000 < day_start(day + 1)
+    assert incident_day(day_start(day)) == day
+
+def test_cube_entry():
+    assert cube_entry(None, 30.25, -97.75) is None
+    assert cube_entry(1672641000, None, -97.75) is None
+    assert cube_entry(1672641000, 40.0, -97.75) is None # outside of the grid
+    day, cell = cube_entry(1672641000, 30.255, -97.745)
+    assert day == incident_day(1672641000) and 0 <= cell < GRID_SHAPE[0] * GRID_SHAPE[1]
+
+def test_update_cube(recording_pipeline):
+    pipe = recording_pipeline()
+    update_cube(pipe, (10, 5), (11, 5))
+    assert pipe.commands == [("hincrby", CUBE_DAY_KEY.format(10), 5, -1),
+                             ("hincrby", CUBE_DAY_KEY.format(11), 5, 1),
+                             ("zadd", CUBE_DAYS_KEY, {11: 11})]
+    pipe = recording_pipeline()
+    update_cube(pipe, (10, 5), (10, 5))
+    assert pipe.commands == []
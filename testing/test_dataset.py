@@ -0,0 +1,50 @@
+from dataset import index_incident, clear_dataset, VERSION_KEY, ALL_KEY, ISSUE_KEY, STATUS_KEY, PUBLISHED_KEY, UPDATED_KEY, GEO_KEY, \
+        ISSUE_COUNTS_KEY, LATITUDE_KEY
+
+def test_index_incident(recording_pipeline):
+    pipe = recording_pipeline()
+    incident = {"traffic_report_id": "A_1", "issue_reported": "Crash Urgent",
+                "traffic_report_status": "ARCHIVED", "published_date": "100",
+                "traffic_report_status_date_time": ""}
+    previous = {"issue_reported": "Crash Urgent", "traffic_report_status": "ACTIVE",
+                "published_date": "100", "traffic_report_status_date_time": None}
+    index_incident(pipe, incident, previous)
+    assert ("sadd", ALL_KEY, "A_1") in pipe.commands
+    assert ("sadd", ISSUE_KEY.format("crash urgent"), "A_1") in pipe.commands
+    assert ("srem", STATUS_KEY.format("active"), "A_1") in pipe.commands
+    assert ("sadd", STATUS_KEY.format("archived"), "A_1") in pipe.commands
+    assert ("zadd", PUBLISHED_KEY, {"A_1": 100.0}) in pipe.commands
+    assert ("zrem", UPDATED_KEY, "A_1") in pipe.commands
+    assert not any(cmd[0] == "srem" and cmd[1].startswith("idx:issue") for cmd in pipe.commands)
+
+def test_index_incident_geo(recording_pipeline):
+    pipe = recording_pipeline()
+    index_incident(pipe, {"traffic_report_id": "A_1", "latitude": "30.28", "longitude": "-97.73"})
+    assert ("geoadd", GEO_KEY, [-97.73, 30.28, "A_1"]) in pipe.commands
+    # blanked out coordinates (see ingest.clean_incident) leave the geo index
+    pipe = recording_pipeline()
+    index_incident(pipe, {"traffic_report_id": "A_1", "latitude": "", "longitude": ""})
+    assert ("zrem", GEO_KEY, "A_1") in pipe.commands
+
+def test_index_incident_stats(recording_pipeline):
+    pipe = recording_pipeline()
+    index_incident(pipe, {"traffic_report_id": "A_1", "issue_reported": "Crash Urgent",
+                          "latitude": "30.28", "longitude": "-97.73"},
+                   {"issue_reported": "Traffic Hazard"})
+    assert ("hincrby", ISSUE_COUNTS_KEY, "Traffic Hazard", -1) in pipe.commands
+    assert ("hincrby", ISSUE_COUNTS_KEY, "Crash Urgent", 1) in pipe.commands
+    assert ("zadd", LATITUDE_KEY, {"A_1": 30.28}) in pipe.commands
+    # rewriting the same issue leaves the counts alone
+    pipe = recording_pipeline()
+    index_incident(pipe, {"traffic_report_id": "A_1", "issue_reported": "Crash Urgent"},
+                   {"issue_reported": "Crash Urgent"})
+    assert not any(cmd[0] == "hincrby" for cmd in pipe.commands)
+
+def test_clear_dataset(recording_client):
+    client = recording_client
+    version = clear_dataset(client)
+    # flushed without blocking redis, and readers never see the empty dataset under the old version
+    assert client.transaction
+    assert client.pipe.commands[0] == ("flushdb", ("asynchronous", True))
+    assert ("set", VERSION_KEY, version) in client.pipe.commands
+    assert client.pipe.commands[-1] == ("execute",)
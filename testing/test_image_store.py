@@ -0,0 +1,70 @@
+import io
+import json
+import os
+import pytest
+import image_store
+from image_store import save_image, load_image, delete_stored_image
+
+PNG = b'\x89PNG\r\n\x1a\n' + bytes(range(256))
+
+
+@pytest.fixture
+def images(fake_redis):
+    """Image database (bytes replies, like jobs.rd_images) on the server of fake_redis"""
+    fakeredis = pytest.importorskip("fakeredis")
+    return fakeredis.FakeRedis(server=fake_redis.connection_pool.connection_kwargs['server'], db=5)
+
+
+@pytest.fixture
+def image_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(image_store, 'IMAGE_DIR', str(tmp_path / 'images'))
+    return tmp_path / 'images'
+
+
+@pytest.mark.parametrize('store', ['redis', 'local'])
+def test_image_round_trip(store, images, image_dir):
+    results = save_image(images, io.BytesIO(PNG), 'png', store=store)
+    assert results['store'] == store and results['format'] == 'png'
+    assert load_image(images, results) == (PNG, 'image/png')
+    assert delete_stored_image(images, results)
+    assert load_image(images, results) == (None, 'image/png')
+    assert not delete_stored_image(images, results)
+
+
+def test_local_images_are_files(images, image_dir):
+    results = save_image(images, io.BytesIO(PNG), 'svg', store='local')
+    assert os.listdir(image_dir) == [f"{results['id']}.svg"]
+    assert load_image(images, results) == (PNG, 'image/svg+xml')
+    assert images.dbsize() == 0
+
+
+def test_unknown_store(images, image_dir):
+    with pytest.raises(ValueError):
+        save_image(images, io.BytesIO(PNG), store='s3')
+
+
+def test_deleting_jobs_deletes_images(fake_redis, images, image_dir, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    worker = pytest.importorskip("worker")
+    import jobs
+    server = fake_redis.connection_pool.connection_kwargs['server']
+    details = fakeredis.FakeRedis(server=server, db=2)
+    results_db = fakeredis.FakeRedis(server=server, db=3)
+    monkeypatch.setattr(jobs, 'rd_details', details)
+    monkeypatch.setattr(worker, 'rd_details', details)
+    monkeypatch.setattr(worker, 'rd_images', images)
+    monkeypatch.setattr(worker, 'rd_results', results_db)
+    stored = {'plot-redis': save_image(images, io.BytesIO(PNG), store='redis'),
+              'plot-local': save_image(images, io.BytesIO(PNG), store='local')}
+    for jid, results in stored.items():
+        details.set(jid, json.dumps({'id': jid, 'job_type': 'plot-heatmap', 'status': 'completed',
+                                     'results': results}))
+    details.set('delete', json.dumps({'id': 'delete', 'job_type': 'delete', 'status': 'submitted'}))
+    results_db.set('result:cached', json.dumps(stored['plot-redis']))
+
+    worker._execute_job('delete')
+
+    for results in stored.values():
+        assert load_image(images, results)[0] is None
+    assert os.listdir(image_dir) == []
+    assert details.dbsize() == 0 and results_db.dbsize() == 0
@@ -0,0 +1,147 @@
+import pytest
+import json
+import ingest
+from ingest import get_columns, clean_incident, stream_rows_json, iter_source_chunks, changed_since, load_incidents, \
+        write_incidents
+from dataset import get_dataset_version, get_incident, get_watermark, ALL_KEY, ISSUE_KEY, STATUS_KEY, ISSUE_COUNTS_KEY
+from storage import read_incidents, STORAGE_FORMATS
+from connections import INCIDENTS_DB, STAGING_DB
+
+ROWS_JSON = {"meta": {"view": {"columns": [{"fieldName": ":id", "flags": ["hidden"]},
+                                           {"fieldName": "traffic_report_id"},
+                                           {"fieldName": "published_date"},
+                                           {"fieldName": "issue_reported"}]}},
+             "data": [["row-1", "A_1", 1676849336, "Crash Urgent"],
+                      ["row-2", "B_2", 1548307003, "Stalled Vehicle \u00e9"],
+                      ["row-3", "C_3", None, "Traffic Hazard"]]}
+
+def _chunks(text:str, size:int):
+    data = text.encode("utf-8")
+    return [data[ii:ii + size] for ii in range(0, len(data), size)]
+
+def test_clean_incident():
+    meta = {"view": {"columns": [{"fieldName": ":id", "flags": ["hidden"]},
+                                 {"fieldName": "traffic_report_id"},
+                                 {"fieldName": "latitude"},
+                                 {"fieldName": "longitude"},
+                                 {"fieldName": "address"}]}}
+    cols, flags = get_columns(meta)
+    assert cols == ["id", "traffic_report_id", "latitude", "longitude", "address"]
+    assert clean_incident(["row-1", "A_1", "30.28", "-97.73", None], cols, flags) == \
+        {"traffic_report_id": "A_1", "latitude": "30.28", "longitude": "-97.73", "address": ""}
+    # coordinates far away from Austin are blanked out together
+    assert clean_incident(["row-2", "B_2", "30.28", "-117.73", "x"], cols, flags) == \
+        {"traffic_report_id": "B_2", "latitude": "", "longitude": "", "address": "x"}
+
+def test_stream_rows_json():
+    text = json.dumps(ROWS_JSON, indent=2)
+    for size in (1, 7, 64, len(text)):
+        rows = list(stream_rows_json(_chunks(text, size)))
+        assert rows[0] == ROWS_JSON["meta"]
+        assert rows[1:] == ROWS_JSON["data"]
+    assert list(stream_rows_json(['{"meta": {}, "data": []}'])) == [{}]
+
+def test_stream_rows_json_malformed():
+    with pytest.raises(ValueError):
+        list(stream_rows_json(['{"data": [[1]], "meta": {}}']))
+    with pytest.raises(ValueError):
+        list(stream_rows_json(['{"meta": {}, "data": [[1], [2']))
+
+def test_iter_source_chunks(tmp_path):
+    path = tmp_path / "rows.json"
+    path.write_text(json.dumps(ROWS_JSON))
+    rows = stream_rows_json(iter_source_chunks(f"file://{path}", chunk_size=16))
+    assert next(rows) == ROWS_JSON["meta"]
+    assert [row[1] for row in rows] == ["A_1", "B_2", "C_3"]
+
+def test_changed_since():
+    incidents = [{"traffic_report_id": "A_1", "published_date": "100", "traffic_report_status_date_time": "150"},
+                 {"traffic_report_id": "B_2", "published_date": "200", "traffic_report_status_date_time": "300"},
+                 {"traffic_report_id": "C_3", "published_date": "90", "traffic_report_status_date_time": ""}]
+    newest = {}
+    assert len(list(changed_since(incidents, {}, newest))) == 3
+    assert newest == {"published_date": 200.0, "traffic_report_status_date_time": 300.0}
+    # only B_2 was published or updated after the watermark
+    watermark = {"published_date": 150.0, "traffic_report_status_date_time": 250.0}
+    assert [inc["traffic_report_id"] for inc in changed_since(incidents, watermark, {})] == ["B_2"]
+
+def test_load_incidents_swaps_in_the_refresh(fake_redis, tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fake_redis.connection_pool.connection_kwargs['server']
+    staging = fakeredis.FakeRedis(server=server, db=STAGING_DB, decode_responses=True)
+    locks = fakeredis.FakeRedis(server=server, db=1, decode_responses=True)
+    path = tmp_path / "rows.json"
+    path.write_text(json.dumps(ROWS_JSON))
+    assert load_incidents(fake_redis, staging, locks, batch_size=2, source=str(path)) == 3
+    old_version = get_dataset_version(fake_redis)
+    assert old_version and fake_redis.smembers(ALL_KEY) == {"A_1", "B_2", "C_3"}
+
+    refresh = dict(ROWS_JSON, data=[["row-4", "D_4", 1676849400, "Crash Service"]])
+    path.write_text(json.dumps(refresh))
+    staging.set("leftover", 1) # from an interrupted refresh
+    published = []
+    def publish_dataset(staging_client, staging_db, live_db):
+        # the refresh is complete in db 6, db 0 still serves the previous dataset
+        assert (staging_db, live_db) == (STAGING_DB, INCIDENTS_DB)
+        assert get_dataset_version(fake_redis) == old_version
+        assert fake_redis.smembers(ALL_KEY) == {"A_1", "B_2", "C_3"}
+        assert staging.smembers(ALL_KEY) == {"D_4"} and not staging.exists("leftover")
+        published.append(get_dataset_version(staging))
+        return real_publish_dataset(staging_client, staging_db, live_db)
+    real_publish_dataset = ingest.publish_dataset
+    monkeypatch.setattr(ingest, "publish_dataset", publish_dataset)
+    assert load_incidents(fake_redis, staging, locks, batch_size=2, source=str(path)) == 1
+    # the new dataset and its version are live, the previous one was dropped with db 6
+    assert published and get_dataset_version(fake_redis) == published[0] != old_version
+    assert fake_redis.smembers(ALL_KEY) == {"D_4"}
+    assert get_incident(fake_redis, "D_4")["issue_reported"] == "Crash Service"
+    assert get_incident(fake_redis, "A_1") is None
+    assert staging.dbsize() == 0
+
+@pytest.mark.parametrize("storage_format", STORAGE_FORMATS)
+def test_write_incidents_duplicate_in_batch(storage_format, fake_redis):
+    rows = [{"traffic_report_id": "A_1", "issue_reported": "Crash Urgent", "traffic_report_status": "ACTIVE",
+             "published_date": "100"},
+            {"traffic_report_id": "B_2", "issue_reported": "Crash Urgent", "traffic_report_status": "ACTIVE",
+             "published_date": "200"},
+            {"traffic_report_id": "A_1", "issue_reported": "Traffic Hazard", "traffic_report_status": "ARCHIVED",
+             "published_date": "100"}]
+    assert write_incidents(fake_redis, rows, batch_size=10, storage_format=storage_format) == 2
+    # the last row of A_1 wins, and A_1 is indexed once
+    assert fake_redis.smembers(ISSUE_KEY.format("crash urgent")) == {"B_2"}
+    assert fake_redis.smembers(ISSUE_KEY.format("traffic hazard")) == {"A_1"}
+    assert fake_redis.smembers(STATUS_KEY.format("active")) == {"B_2"}
+    assert fake_redis.hgetall(ISSUE_COUNTS_KEY) == {"Crash Urgent": "1", "Traffic Hazard": "1"}
+    assert read_incidents(fake_redis, ["A_1"], ("issue_reported",), storage_format) == \
+        [{"issue_reported": "Traffic Hazard"}]
+    # the same rows again over two batches, with the previous values read in the same format
+    write_incidents(fake_redis, rows, batch_size=2, storage_format=storage_format)
+    assert fake_redis.scard(ALL_KEY) == 2
+    assert fake_redis.hgetall(ISSUE_COUNTS_KEY) == {"Crash Urgent": "1", "Traffic Hazard": "1"}
+    assert fake_redis.smembers(ISSUE_KEY.format("traffic hazard")) == {"A_1"}
+    assert fake_redis.smembers(STATUS_KEY.format("archived")) == {"A_1"}
+
+
+def test_load_incidents_delta_moves_the_watermark_last(fake_redis, tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fake_redis.connection_pool.connection_kwargs['server']
+    staging = fakeredis.FakeRedis(server=server, db=STAGING_DB, decode_responses=True)
+    locks = fakeredis.FakeRedis(server=server, db=1, decode_responses=True)
+    path = tmp_path / "rows.json"
+    path.write_text(json.dumps(ROWS_JSON))
+    load_incidents(fake_redis, staging, locks, source=str(path))
+    watermark, version = get_watermark(fake_redis), get_dataset_version(fake_redis)
+    path.write_text(json.dumps(dict(ROWS_JSON, data=ROWS_JSON["data"] + [["row-4", "D_4", 1676849400, "Crash Service"]])))
+
+    def fail(pipe):
+        raise ConnectionError("lost redis")
+    monkeypatch.setattr(ingest, "bump_dataset_version", fail)
+    with pytest.raises(ConnectionError):
+        load_incidents(fake_redis, staging, locks, source=str(path), delta=True)
+    # D_4 is committed, but the watermark did not move: the next delta writes it again
+    assert fake_redis.sismember(ALL_KEY, "D_4")
+    assert get_watermark(fake_redis) == watermark and get_dataset_version(fake_redis) == version
+    monkeypatch.undo()
+    assert load_incidents(fake_redis, staging, locks, source=str(path), delta=True) == 1
+    assert get_watermark(fake_redis)["published_date"] == 1676849400
+    assert get_dataset_version(fake_redis) != version
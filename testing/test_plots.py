@@ -0,0 +1,99 @@
+import time
+import numpy as np
+import pytest
+from plots import time_histogram, load_grid_counts
+from cube import GRID_BBOX, GRID_SHAPE, CUBE_READY_KEY, CUBE_DAYS_KEY
+from dataset import INGEST_LOCK_KEY
+from ingest import write_incidents
+from redis.exceptions import LockError
+
+# 2023-01-02 (a Monday) 00:30 and 2023-01-03 13:00, America/Chicago
+MONDAY = 1672641000
+TUESDAY = 1672772400
+
+
+@pytest.fixture(autouse=True)
+def chicago_time(monkeypatch):
+    """Calendar bins follow the local timezone, the epochs above are Chicago times"""
+    monkeypatch.setenv('TZ', 'America/Chicago')
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def test_time_histogram_calendar_bins():
+    published = np.array([MONDAY, TUESDAY, TUESDAY + 6 * 86400], dtype=float)
+    labels, counts = time_histogram(published, 'year')
+    assert labels == ['2023'] and counts.tolist() == [3]
+    labels, counts = time_histogram(published, 'day')
+    assert labels[:3] == ['2023-01-02', '2023-01-03', '2023-01-04']
+    assert len(labels) == 8 and counts.tolist() == [1, 1, 0, 0, 0, 0, 0, 1]
+    labels, counts = time_histogram(published, 'week')
+    assert labels == ['2023-01-02', '2023-01-09'] and counts.tolist() == [2, 1]
+
+
+def test_time_histogram_cyclic_bins():
+    published = np.array([MONDAY, TUESDAY, TUESDAY], dtype=float)
+    labels, counts = time_histogram(published, 'weekday')
+    assert labels[0] == 'Mon' and counts.tolist() == [1, 2, 0, 0, 0, 0, 0]
+    labels, counts = time_histogram(published, 'hour')
+    assert len(labels) == 24 and counts[0] == 1 and counts[13] == 2
+
+
+def test_time_histogram_empty_and_invalid():
+    labels, counts = time_histogram(np.array([]), 'month')
+    assert labels == [] and len(counts) == 0
+    assert time_histogram(np.array([]), 'hour')[1].sum() == 0
+    with pytest.raises(ValueError):
+        time_histogram(np.array([MONDAY]), 'decade')
+
+
+def test_load_grid_counts(fake_redis):
+    fakeredis = pytest.importorskip("fakeredis")
+    locks = fakeredis.FakeRedis(server=fake_redis.connection_pool.connection_kwargs['server'], db=1)
+    rng = np.random.default_rng(0)
+    published = MONDAY + rng.integers(-2 * 86400, 9 * 86400, 400)
+    lat = rng.uniform(29.9, 31.2, 400) # some fall outside of the grid
+    lon = rng.uniform(-99.0, -96.9, 400)
+    start, end = int(published[0]), int(published[0]) + 5 * 86400 + 4000
+    published[1:3] = start, end # bounds are inclusive
+    # earlier rows of the first incidents in the same batch, their last row wins
+    stale = [{"traffic_report_id": f"ID_{ii}", "published_date": str(start + 3600),
+              "latitude": "30.267100", "longitude": "-97.743100"} for ii in range(10)]
+    write_incidents(fake_redis, stale + [{"traffic_report_id": f"ID_{ii}", "published_date": str(published[ii]),
+                                          "latitude": f"{lat[ii]:.6f}", "longitude": f"{lon[ii]:.6f}"}
+                                         for ii in range(400)])
+
+    def expected(low, high):
+        inside = (published >= low) & (published <= high)
+        counts, _, _ = np.histogram2d(np.round(lon[inside], 6), np.round(lat[inside], 6), bins=GRID_SHAPE,
+                                      range=[[GRID_BBOX[0], GRID_BBOX[1]], [GRID_BBOX[2], GRID_BBOX[3]]])
+        return counts
+
+    # the cube kept up to date by the ingest, then the cube rebuilt under the ingest lock
+    fake_redis.set(CUBE_READY_KEY, 1)
+    for rebuild in (False, True):
+        if rebuild:
+            fake_redis.delete(CUBE_READY_KEY)
+        # partial days at both ends, inside a single day, and unbounded
+        for low, high in [(start, end), (start, start + 3600), (None, end), (start, None), (None, None)]:
+            counts = load_grid_counts(fake_redis, locks, low, high)
+            assert counts.shape == GRID_SHAPE
+            assert (counts == expected(-np.inf if low is None else low, np.inf if high is None else high)).all()
+    assert fake_redis.exists(CUBE_READY_KEY) and fake_redis.zcard(CUBE_DAYS_KEY) > 0
+    assert not locks.exists(INGEST_LOCK_KEY)
+
+
+def test_load_grid_counts_during_ingest(fake_redis):
+    fakeredis = pytest.importorskip("fakeredis")
+    locks = fakeredis.FakeRedis(server=fake_redis.connection_pool.connection_kwargs['server'], db=1)
+    write_incidents(fake_redis, [{"traffic_report_id": "ID_1", "published_date": str(MONDAY),
+                                  "latitude": "30.267100", "longitude": "-97.743100"}])
+    ingest = locks.lock(INGEST_LOCK_KEY, timeout=60)
+    assert ingest.acquire(blocking=False)
+    # the cube must be built, the ingest holds the lock past blocking_timeout
+    with pytest.raises(LockError):
+        load_grid_counts(fake_redis, locks, MONDAY, MONDAY + 86400, blocking_timeout=0.1)
+    ingest.release()
+    assert load_grid_counts(fake_redis, locks, MONDAY, MONDAY + 86400, blocking_timeout=0.1).sum() == 1
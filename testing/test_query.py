@@ -0,0 +1,56 @@
+import pytest
+from query import compile_filter, encode_cursor, decode_cursor, filter_incidents
+from ingest import write_incidents
+from scan import batched
+
+INCIDENT = {"traffic_report_id": "A_1", "issue_reported": "Crash Urgent",
+            "traffic_report_status": "ACTIVE", "published_date": "1673538900",
+            "latitude": "30.236481", "longitude": "-97.822568"}
+
+def test_compile_filter():
+    assert compile_filter()(INCIDENT) == True
+    assert compile_filter(incident_type="CRASH URGENT", status="active")(INCIDENT) == True
+    assert compile_filter(incident_type="Traffic Hazard")(INCIDENT) == False
+    assert compile_filter(start=1673538900, end=1673538900)(INCIDENT) == True
+    assert compile_filter(start=1673538901)(INCIDENT) == False
+    # same point and radii as test_is_in_bounds
+    assert compile_filter(radius=7, lng=-97.738037, lat=30.286020)(INCIDENT) == True
+    assert compile_filter(radius=5, lng=-97.738037, lat=30.286020)(INCIDENT) == False
+    assert compile_filter(radius=7, lng=-97.738037, lat=30.286020)(dict(INCIDENT, latitude="")) == False
+
+def test_cursor():
+    position = (1673538900.0, "0BC39B9D01F6D3E81328CDA94EAEFE5005744CEC_1630245918")
+    assert decode_cursor(encode_cursor(position)) == position
+    with pytest.raises(ValueError):
+        decode_cursor("not a cursor")
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched([], 2)) == []
+
+def _pages(client, limit, offset=0, **kwargs):
+    """Follows the cursors of filter_incidents() to the last page"""
+    pages, cursor = [], None
+    while True:
+        page, cursor = filter_incidents(client, limit=limit, offset=offset, cursor=cursor, **kwargs)
+        pages.append([incident["traffic_report_id"] for incident in page])
+        offset = 0
+        if cursor is None:
+            return pages
+
+def test_cursor_pages(fake_redis):
+    # 4 incidents share every published_date, pages of 3 split them
+    write_incidents(fake_redis, [{"traffic_report_id": f"ID_{ii:02d}", "published_date": str(1000 + ii // 4),
+                                  "issue_reported": "Crash Urgent" if ii % 2 else "Traffic Hazard"}
+                                 for ii in reversed(range(14))])
+    expected = [f"ID_{ii:02d}" for ii in range(14)]
+    pages = _pages(fake_redis, 3)
+    assert [len(page) for page in pages] == [3, 3, 3, 3, 2]
+    assert sum(pages, []) == expected
+    # the offset only applies to the first page, the cursors then resume right after the last match
+    assert sum(_pages(fake_redis, 3, offset=5), []) == expected[5:]
+    assert sum(_pages(fake_redis, 2, offset=1, incident_type="crash urgent"), []) == expected[1::2][1:]
+    # a cursor stays valid with another page size
+    first, cursor = filter_incidents(fake_redis, limit=5)
+    rest, _ = filter_incidents(fake_redis, limit=3, offset=2, cursor=cursor)
+    assert [incident["traffic_report_id"] for incident in first + rest] == expected[:5] + expected[7:10]
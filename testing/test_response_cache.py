@@ -0,0 +1,48 @@
+import json
+import response_cache
+from response_cache import response_key, get_response, put_response, clear_responses
+
+
+def test_response_key():
+    params = {'limit': 2, 'radius': float('inf')}
+    assert response_key('ids', params, 'v1') == response_key('ids', dict(reversed(params.items())), 'v1')
+    assert response_key('ids', params, 'v1') != response_key('incidents', params, 'v1')
+    assert response_key('ids', params, 'v1') != response_key('ids', params, 'v2')
+
+
+def test_memory_tier_evicts_least_recently_used(monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_SIZE', 2)
+    clear_responses()
+    put_response('a', [1], {})
+    put_response('b', [2], {'X-Next-Cursor': 'c'})
+    assert get_response('a') == ([1], {}) # 'a' is now the most recently used
+    put_response('c', [3], {})
+    assert get_response('b') is None
+    assert get_response('a') == ([1], {}) and get_response('c') == ([3], {})
+    clear_responses()
+
+
+def test_memory_tier_is_bounded_by_bytes(monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_BYTES', 100)
+    clear_responses()
+    put_response('a', ['x' * 30], {})
+    put_response('b', ['y' * 30], {})
+    put_response('c', ['z' * 30], {}) # over 100 serialized bytes, 'a' goes
+    assert get_response('a') is None
+    assert get_response('b') == (['y' * 30], {}) and get_response('c') == (['z' * 30], {})
+    put_response('c', ['z'], {}) # replacing an entry releases its bytes
+    assert response_cache._responses_bytes == len(json.dumps([['y' * 30], {}])) + len(json.dumps([['z'], {}]))
+    clear_responses()
+    assert response_cache._responses_bytes == 0
+
+
+def test_large_responses_are_not_cached(fake_redis, monkeypatch):
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_MAX_ENTRY_BYTES', 50)
+    clear_responses()
+    put_response('whole', ['x' * 100], {}, client=fake_redis)
+    assert get_response('whole', fake_redis) is None and fake_redis.dbsize() == 0
+    put_response('page', ['x'], {}, client=fake_redis)
+    clear_responses()
+    assert get_response('page', fake_redis) == (['x'], {}) # from redis, then kept in memory
+    assert get_response('page') == (['x'], {})
+    clear_responses()
@@ -0,0 +1,15 @@
+from result_cache import result_key
+
+
+def test_result_key_ignores_parameter_order():
+    assert result_key('plot-timeseries', 1, 2, {'granularity': 'day', 'a': 1}, 'v1') \
+        == result_key('plot-timeseries', '1', '2', {'a': 1, 'granularity': 'day'}, 'v1')
+
+
+def test_result_key_depends_on_job_and_dataset():
+    key = result_key('plot-heatmap', 1, 2, None, 'v1')
+    assert key.startswith('result:')
+    assert key != result_key('plot-dotmap', 1, 2, None, 'v1')
+    assert key != result_key('plot-heatmap', 1, 3, None, 'v1')
+    assert key != result_key('plot-heatmap', 1, 2, {'granularity': 'day'}, 'v1')
+    assert key != result_key('plot-heatmap', 1, 2, None, 'v2')
@@ -0,0 +1,28 @@
+import numpy as np
+from snapshot import haversine_miles, query_mask
+
+SNAPSHOT = {"version": "v1",
+            "ids": ["A_1", "B_2", "C_3", "D_4"],
+            "published": np.array([100.0, 200.0, 200.0, 300.0]),
+            "issue": np.array([0, 1, 0, 0], dtype=np.int32),
+            "status": np.array([0, 0, 1, 0], dtype=np.int32),
+            "lat": np.array([30.236481, 30.286020, np.nan, 31.0]),
+            "lon": np.array([-97.822568, -97.738037, np.nan, -97.0]),
+            "issue_codes": {"crash urgent": 0, "traffic hazard": 1},
+            "status_codes": {"archived": 0, "active": 1}}
+
+def test_haversine_miles():
+    distance = haversine_miles(30.286020, -97.738037, np.array([30.236481]), np.array([-97.822568]))
+    # geodesic distance of the test_is_in_bounds points is ~6.0 miles
+    assert 5.9 < distance[0] < 6.1
+
+def test_query_mask():
+    mask, needs_check = query_mask(SNAPSHOT)
+    assert mask.tolist() == [True, True, True, True]
+    mask, _ = query_mask(SNAPSHOT, incident_type="CRASH URGENT", status="archived", start=150)
+    assert mask.tolist() == [False, False, False, True]
+    mask, _ = query_mask(SNAPSHOT, incident_type="unknown")
+    assert not mask.any()
+    mask, needs_check = query_mask(SNAPSHOT, radius=7, lng=-97.738037, lat=30.286020)
+    assert mask.tolist() == [True, True, False, False]
+    assert not needs_check.any()
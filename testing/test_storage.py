@@ -0,0 +1,29 @@
+import numpy as np
+from storage import encode_incident, decode_incident, HEADER_SIZE
+
+CODES = {'issue_reported': {'Crash Urgent': 0, 'Stalled Vehicle é': 1},
+         'traffic_report_status': {'ACTIVE': 0, 'ARCHIVED': 1}}
+DICTIONARIES = {field: sorted(codes, key=codes.get) for field, codes in CODES.items()}
+
+def test_packed_round_trip():
+    incident = {'traffic_report_id': 'A_1', 'published_date': '1676849336', 'issue_reported': 'Stalled Vehicle é',
+                'location': '(30.283797,-97.741906)', 'latitude': '30.283797', 'longitude': '-97.741906',
+                'address': 'N Lamar Blvd', 'traffic_report_status': 'ARCHIVED',
+                'traffic_report_status_date_time': '1676851000', 'agency': ''}
+    record = encode_incident(incident, CODES)
+    # the id, the dates, the coordinates, the codes and the location live in the header
+    assert record[HEADER_SIZE:] == '{"address":"N Lamar Blvd","agency":""}'
+    decoded = decode_incident('A_1', record, DICTIONARIES)
+    lat, lon = str(np.float32(30.283797)), str(np.float32(-97.741906))
+    assert decoded == dict(incident, latitude=lat, longitude=lon, location=f'({lat},{lon})')
+    assert abs(float(decoded['latitude']) - 30.283797) < 1e-5
+
+def test_packed_keeps_values_that_do_not_fit():
+    incident = {'traffic_report_id': 'B_2', 'published_date': '', 'issue_reported': 'Crash Urgent',
+                'latitude': '', 'longitude': '', 'location': '(30.2,-97.7)',
+                'traffic_report_status_date_time': '01676851000', 'traffic_report_status': 'ARCHIVED'}
+    assert decode_incident('B_2', encode_incident(incident, CODES), DICTIONARIES) == incident
+    # numbers are stored like redis stores them in a hash
+    incident = {'traffic_report_id': 'C_3', 'published_date': 1548307003, 'latitude': 30.25, 'address': 12}
+    assert decode_incident('C_3', encode_incident(incident, CODES), DICTIONARIES) == \
+        {'traffic_report_id': 'C_3', 'published_date': '1548307003', 'latitude': '30.25', 'address': '12'}
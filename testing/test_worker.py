@@ -0,0 +1,39 @@
+import json
+import pytest
+import jobs
+from image_store import load_image
+from ingest import write_incidents
+
+
+@pytest.mark.parametrize("failure", ["down", "corrupt"])
+def test_result_cache_failure_is_a_miss(failure, fake_redis, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    worker = pytest.importorskip("worker")
+    server = fake_redis.connection_pool.connection_kwargs['server']
+    details = fakeredis.FakeRedis(server=server, db=2)
+    images = fakeredis.FakeRedis(server=server, db=5)
+    results_server = fakeredis.FakeServer()
+    results = fakeredis.FakeRedis(server=results_server, decode_responses=True)
+    monkeypatch.setattr(jobs, 'rd_details', details)
+    monkeypatch.setattr(worker, 'rd', fake_redis)
+    monkeypatch.setattr(worker, 'rd_details', details)
+    monkeypatch.setattr(worker, 'rd_images', images)
+    monkeypatch.setattr(worker, 'rd_results', results)
+    write_incidents(fake_redis, [{"traffic_report_id": f"ID_{ii}", "published_date": str(1672641000 + ii * 86400),
+                                  "latitude": "30.267100", "longitude": "-97.743100"} for ii in range(3)])
+    job = {'id': 'plot', 'job_type': 'plot-timeseries', 'status': 'submitted',
+           'start': 1672000000, 'end': 1673000000, 'params': {'granularity': 'day'}}
+    if failure == "down":
+        results_server.connected = False
+    else:
+        key = worker.result_key(job['job_type'], job['start'], job['end'], job['params'],
+                                worker.get_dataset_version(fake_redis))
+        results.set(key, "{not json")
+    details.set('plot', json.dumps(job))
+
+    worker._execute_job('plot')
+
+    # the plot was made again instead of the job being left in progress
+    done = json.loads(details.get('plot'))
+    assert done['status'] == 'completed'
+    assert load_image(images, done['results'])[0]